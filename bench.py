@@ -0,0 +1,685 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict, deque
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+
+from aiohttp import ClientSession, web
+from aiogram import Dispatcher
+from aiogram.fsm.storage.memory import MemoryStorage
+
+os.environ.setdefault("DB_PATH", "")
+# exercises per-invoice QR rendering and upload in the load benchmarks
+os.environ.setdefault("UPI_ID", "bench@upi")
+import bot
+
+
+def timed(label, fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<32} {elapsed:8.3f}s")
+    return result, elapsed
+
+
+def fill_orders(db, n):
+    for i in range(n):
+        db.create_order(i, f"user{i}", "1000", 1, 65)
+
+
+def fill_codes(db, n, batch=1000):
+    for start in range(0, n, batch):
+        db.add_codes_from_channel("1000", [f"C{i:09d}" for i in range(start, min(start + batch, n))])
+
+
+def allocate(db, n):
+    for _ in range(n):
+        db.get_available_codes("1000", 1)
+
+
+def bench_inventory(args):
+    db = bot.SimpleDB()
+    timed(f"import {args.codes} codes", fill_codes, db, args.codes, args.batch)
+    timed(f"re-import {args.codes} (all dupes)", fill_codes, db, args.codes, args.batch)
+    timed(f"allocate {args.allocations} codes", allocate, db, args.allocations)
+    _, elapsed = timed(f"{args.allocations} stock counts", lambda: [db.get_stock_count("1000") for _ in range(args.allocations)])
+    print(f"  stock left: {db.get_stock_count('1000')}")
+
+
+async def stress_verify(args):
+    db = bot.db = bot.SimpleDB()
+    admin = bot.ADMIN_USER_IDS[0]
+    fill_codes(db, args.orders * 2)
+    order_ids = [db.create_order(100000 + i, f"user{i}", "1000", 1, 65) for i in range(args.orders)]
+    delivered, rejected = Counter(), Counter()
+    sent_codes = []
+
+    async def jitter():
+        await asyncio.sleep(random.random() * 0.002)
+
+    async def send_message(chat_id, text, **kwargs):
+        await jitter()
+        order_id = text.split("\n")[1].split(": ")[1]
+        if text.startswith("✅"):
+            delivered[order_id] += 1
+            sent_codes.extend(line.split(". ", 1)[1] for line in text.split("\n") if ". " in line)
+        else:
+            rejected[order_id] += 1
+
+    async def noop(*args, **kwargs):
+        await jitter()
+
+    fake_bot = SimpleNamespace(send_message=send_message)
+    events = [(random.choice(("verify", "reject")), oid) for oid in order_ids for _ in range(args.taps)]
+    random.shuffle(events)
+    handlers = {"verify": bot.admin_verify_payment, "reject": bot.admin_reject_payment}
+    callbacks = [
+        (handlers[kind], SimpleNamespace(
+            data=f"{kind}_{oid}", from_user=SimpleNamespace(id=admin), bot=fake_bot,
+            message=SimpleNamespace(edit_text=noop), answer=noop
+        ))
+        for kind, oid in events
+    ]
+    start = time.perf_counter()
+    await asyncio.gather(*(handler(cb, None) for handler, cb in callbacks))
+    elapsed = time.perf_counter() - start
+    violations = sum(1 for oid in order_ids if delivered[oid] > 1 or (delivered[oid] and rejected[oid]) or rejected[oid] > 1)
+    violations += len(sent_codes) - len(set(sent_codes))
+    statuses = Counter(db.get_order(oid).status for oid in order_ids)
+    print(f"  {len(callbacks)} callbacks over {args.orders} orders in {elapsed:.3f}s ({len(callbacks) / elapsed:,.0f}/s)")
+    print(f"  final statuses: {dict(statuses)}")
+    print(f"  stock: {db.get_stock_count('1000')} available, {db.get_reserved_count('1000')} reserved")
+    print(f"  violations (double delivery / delivered+rejected / duplicate codes): {violations}")
+    return violations
+
+
+def bench_verify(args):
+    return 1 if asyncio.run(stress_verify(args)) else 0
+
+
+# Stand-in Bot API server: queues updates for getUpdates and records what the bot sends
+class FakeBotAPI:
+    def __init__(self):
+        self.updates = deque()
+        self.update_id = 0
+        self.message_id = 0
+        self.has_updates = asyncio.Event()
+        self.inbox = defaultdict(asyncio.Queue)
+        self.waiters = {}
+        self.calls = Counter()
+        self.me = {"id": 42, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+
+    def waiter(self, key):
+        if key not in self.waiters:
+            self.waiters[key] = asyncio.get_running_loop().create_future()
+        return self.waiters[key]
+
+    def resolve(self, key, value):
+        fut = self.waiter(key)
+        if not fut.done():
+            fut.set_result(value)
+
+    def message(self, chat_id, sender, **fields):
+        self.message_id += 1
+        return {"message_id": self.message_id, "date": int(time.time()), "chat": {"id": chat_id, "type": "private"},
+                "from": sender, **fields}
+
+    def make_update(self, **payload):
+        self.update_id += 1
+        return {"update_id": self.update_id, **payload}
+
+    def push(self, update):
+        self.updates.append(update)
+        self.has_updates.set()
+
+    async def get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        while self.updates and self.updates[0]["update_id"] < offset:
+            self.updates.popleft()
+        if not self.updates:
+            self.has_updates.clear()
+            try:
+                await asyncio.wait_for(self.has_updates.wait(), float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                pass
+        return list(self.updates)[:int(params.get("limit") or 100)]
+
+    def sent(self, params, **fields):
+        chat_id = int(params["chat_id"])
+        markup = json.loads(params["reply_markup"]) if params.get("reply_markup") else None
+        msg = self.message(chat_id, self.me, **fields, **({"reply_markup": markup} if markup else {}))
+        for row in (markup or {}).get("inline_keyboard", ()):
+            for button in row:
+                if button.get("callback_data", "").startswith("verify_"):
+                    self.resolve(button["callback_data"], msg)
+        self.inbox[chat_id].put_nowait(msg)
+        return msg
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        params = await request.json() if request.content_type == "application/json" else dict(await request.post())
+        self.calls[method] += 1
+        if method == "getUpdates":
+            result = await self.get_updates(params)
+        elif method == "getMe":
+            result = self.me
+        elif method == "sendMessage":
+            result = self.sent(params, text=params["text"])
+        elif method == "sendPhoto":
+            file_id = params["photo"] if isinstance(params["photo"], str) else f"upload{self.message_id}"
+            photo = {"file_id": file_id, "file_unique_id": "p", "width": 1, "height": 1}
+            result = self.sent(params, photo=[photo], caption=params.get("caption", ""))
+        elif method == "editMessageText":
+            result = self.message(int(params["chat_id"]), self.me, text=params["text"])
+        elif method == "answerCallbackQuery":
+            self.resolve(("answer", params["callback_query_id"]), params)
+            result = True
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        return f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+
+# One customer going /buy -> code type -> terms -> quantity -> proof, then an admin verifying it;
+# each step is timed from injecting the update to the bot's last API call for it
+class Journey:
+    def __init__(self, api, send, user_id, latencies, photo=False):
+        self.api, self.send, self.latencies, self.photo = api, send, latencies, photo
+        self.user = {"id": user_id, "is_bot": False, "first_name": f"user{user_id}", "username": f"user{user_id}"}
+        self.admin = {"id": bot.ADMIN_USER_IDS[0], "is_bot": False, "first_name": "admin"}
+        self.updates = 0
+        self.codes = []
+
+    async def _step(self, name, update, done):
+        start = time.perf_counter()
+        self.updates += 1
+        await self.send(update)
+        result = await done()
+        self.latencies[name].append(time.perf_counter() - start)
+        return result
+
+    async def _next_message(self, match):
+        while True:
+            msg = await self.api.inbox[self.user["id"]].get()
+            if match(msg):
+                return msg
+
+    def _text(self, text, **extra):
+        return self.api.make_update(message=self.api.message(self.user["id"], self.user, text=text, **extra))
+
+    async def _callback(self, name, data, sender=None, message=None):
+        sender = sender or self.user
+        cb_id = f"{sender['id']}:{self.api.update_id + 1}"
+        message = message or self.api.message(self.user["id"], self.api.me, text="...")
+        update = self.api.make_update(callback_query={
+            "id": cb_id, "from": sender, "chat_instance": "bench", "data": data, "message": message
+        })
+        await self._step(name, update, lambda: self.api.waiter(("answer", cb_id)))
+        del self.api.waiters[("answer", cb_id)]
+
+    async def run(self):
+        text_of = lambda msg: msg.get("text") or msg.get("caption") or ""
+        await self._step("cmd_buy", self._text("/buy"), lambda: self._next_message(lambda m: text_of(m).startswith("Select")))
+        await self._callback("code_type_selected", "code_1000")
+        await self._callback("terms_accepted", "terms_accept")
+        pay = asyncio.ensure_future(self._next_message(lambda m: "reply_markup" in m))
+        await self._callback("quantity_selected", "qty_1")
+        markup = (await pay)["reply_markup"]["inline_keyboard"]
+        order_id = markup[1][0]["callback_data"].split("_", 1)[1]
+        await self._callback("receive_proof_prompt", f"sendproof_{order_id}")
+        proof = {"photo": [{"file_id": f"proof{order_id}", "file_unique_id": "p", "width": 1, "height": 1}]} if self.photo else {}
+        update = self._text("" if self.photo else f"UTR{order_id}", **proof)
+        if self.photo:
+            del update["message"]["text"]
+        notification = await self._step("handle_payment_proof", update, lambda: self.api.waiter(f"verify_{order_id}"))
+        del self.api.waiters[f"verify_{order_id}"]
+        delivered = asyncio.ensure_future(self._next_message(lambda m: text_of(m).startswith("✅ PAYMENT VERIFIED")))
+        await self._callback("admin_verify_payment", f"verify_{order_id}", self.admin, notification)
+        self.codes = [line.split(". ", 1)[1] for line in (await delivered)["text"].split("\n") if ". " in line]
+
+
+def rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+async def run_journeys(args, api, send):
+    latencies = defaultdict(list)
+    journeys = [Journey(api, send, 10_000_000 + i, latencies, photo=i % 2 == 1) for i in range(args.users)]
+    gate = asyncio.Semaphore(args.concurrency)
+
+    async def guarded(journey):
+        async with gate:
+            await journey.run()
+
+    start = time.perf_counter()
+    await asyncio.wait_for(asyncio.gather(*(guarded(j) for j in journeys)), args.timeout)
+    return journeys, latencies, time.perf_counter() - start
+
+
+def report(label, args, api, journeys, latencies, elapsed):
+    updates = sum(j.updates for j in journeys)
+    codes = [code for j in journeys for code in j.codes]
+    print(f"{label} {args.users} journeys, concurrency {args.concurrency}")
+    print(f"  {updates} updates in {elapsed:.2f}s: {updates / elapsed:,.0f} updates/s, {args.users / elapsed:,.1f} journeys/s")
+    print(f"  {'step':<24} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, values in latencies.items():
+        print(f"  {name:<24} {percentile(values, 0.5) * 1000:8.2f} {percentile(values, 0.99) * 1000:8.2f}")
+    print(f"  Bot API calls: {dict(api.calls)}")
+    print(f"  codes delivered: {len(codes)}, duplicates: {len(codes) - len(set(codes))}")
+    return len(codes) - len(set(codes))
+
+
+async def run_load(args, mode, dp):
+    bot.db = bot.SimpleDB()
+    bot.notifier = bot.AdminNotifier()
+    bot.order_locks = bot.LockStripes()
+    fill_codes(bot.db, args.users)
+    api = FakeBotAPI()
+    bot.BOT_API_URL = await api.start()
+    bot.BOT_TOKEN = "42:BENCH"
+    tg = bot.create_bot()
+    if mode == "polling":
+        runner = asyncio.create_task(dp.start_polling(tg, handle_signals=False, polling_timeout=10))
+        send = lambda update: api.push(update) or asyncio.sleep(0)
+        client = None
+    else:
+        app = bot.build_webhook_app(tg, dp)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        app["handler"].ready = True
+        url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}{bot.WEBHOOK_PATH}"
+        headers = {"X-Telegram-Bot-Api-Secret-Token": bot.WEBHOOK_SECRET} if bot.WEBHOOK_SECRET else {}
+        client = ClientSession()
+
+        async def send(update):
+            async with client.post(url, json=update, headers=headers) as resp:
+                resp.raise_for_status()
+
+    rss_before = rss_mb()
+    journeys, latencies, elapsed = await run_journeys(args, api, send)
+    rss_after = rss_mb()
+    if mode == "polling":
+        await dp.stop_polling()
+        await runner
+    else:
+        await client.close()
+        await runner.cleanup()
+    await api.runner.cleanup()
+    report(f"[{mode}]", args, api, journeys, latencies, elapsed)
+    print(f"  peak RSS {rss_before:.1f} -> {rss_after:.1f} MB (+{rss_after - rss_before:.1f})")
+    print(f"  orders: {len(bot.db.get_orders_by_status('delivered'))} delivered of {len(bot.db.orders)}")
+
+
+def bench_load(args):
+    # the router can only be attached once, so both modes share a dispatcher
+    dp = Dispatcher(storage=MemoryStorage())
+    dp.include_router(bot.router)
+    async def close_notifier():
+        await bot.notifier.close()
+    dp.shutdown.register(close_notifier)
+    for mode in ("polling", "webhook") if args.mode == "both" else (args.mode,):
+        asyncio.run(run_load(args, mode, dp))
+
+
+def free_port(span=1):
+    # the master listens on the port and its workers on the next ones
+    while True:
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        if port + span < 65536:
+            return port
+
+
+async def run_workers(args, workers, tmp):
+    path = os.path.join(tmp, f"shop{workers}.db")
+    db = bot.SimpleDB(bot.SQLiteBackend(path))
+    fill_codes(db, args.users)
+    db.close()
+    api = FakeBotAPI()
+    port = free_port(workers + 1)
+    env = {
+        **os.environ, "BOT_MODE": "webhook", "BOT_WORKERS": str(workers), "BOT_TOKEN": "42:BENCH",
+        "BOT_API_URL": await api.start(), "WEBHOOK_HOST": "127.0.0.1", "WEBHOOK_PORT": str(port),
+        "WEBHOOK_URL": "", "WEBHOOK_SECRET": "", "METRICS_PORT": "0",
+        "DB_PATH": path, "FSM_DB_PATH": os.path.join(tmp, f"fsm{workers}.db"),
+    }
+    log = open(os.path.join(tmp, f"bot{workers}.log"), "w")
+    proc = subprocess.Popen([sys.executable, bot.__file__], env=env, stdout=log, stderr=subprocess.STDOUT)
+    client = ClientSession()
+    try:
+        deadline = time.monotonic() + 60
+        while True:
+            if proc.poll() is not None or time.monotonic() > deadline:
+                raise RuntimeError(f"bot did not start, see {log.name}")
+            try:
+                async with client.get(f"http://127.0.0.1:{port}/readyz") as resp:
+                    if resp.status == 200:
+                        break
+            except OSError:
+                pass
+            await asyncio.sleep(0.2)
+        url = f"http://127.0.0.1:{port}{bot.WEBHOOK_PATH}"
+
+        async def send(update):
+            async with client.post(url, json=update) as resp:
+                resp.raise_for_status()
+
+        journeys, latencies, elapsed = await run_journeys(args, api, send)
+    finally:
+        await client.close()
+        proc.send_signal(signal.SIGTERM)
+        await asyncio.to_thread(proc.wait)
+        log.close()
+        await api.runner.cleanup()
+    return report(f"[{workers} worker{'s' if workers > 1 else ''}]", args, api, journeys, latencies, elapsed)
+
+
+def bench_workers(args):
+    # each run is a real `python bot.py` in webhook mode; 1 worker is the plain single-process server
+    with tempfile.TemporaryDirectory() as tmp:
+        duplicates = [asyncio.run(run_workers(args, n, tmp)) for n in args.workers]
+    print(f"  (cpu cores: {os.cpu_count()})")
+    return 1 if any(duplicates) else 0
+
+
+def fill_users(db, n, buyers_every=3):
+    now = int(time.time())
+    reg = db.users
+    for i in range(n):
+        reg.touch(i, now - (i % 90) * 86400)
+        if i % buyers_every == 0:
+            reg.record_purchase(i, "1000" if i % 2 else "500", 65, now - (i % 60) * 86400)
+        db.backend.save_user(reg.row(i))
+
+
+def bench_users(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "users.db")
+        db = bot.SimpleDB(bot.SQLiteBackend(path))
+        timed(f"register {args.users} users", fill_users, db, args.users)
+        timed("flush to disk", db.backend.flush)
+        for segment in (("all",), ("never",), ("active", None, 7), ("bought", "1000", 30)):
+            users, _ = timed(f"segment {' '.join(str(x) for x in segment if x)}", db.get_segment, *segment)
+            print(f"  {'':<32} {len(users):>8} users")
+        db.close()
+        db, _ = timed("reload registry", bot.SimpleDB, bot.SQLiteBackend(path))
+        print(f"  {db.get_user_stats()}")
+        db.close()
+
+
+async def run_reconcile(args):
+    db = bot.db = bot.SimpleDB()
+    bot.order_locks = bot.LockStripes()
+    bot.BROADCAST_RATE = 1e9
+    fill_codes(db, args.orders)
+    order_ids = []
+    for i in range(args.orders):
+        order_id = db.create_order(100000 + i, f"user{i}", "1000", 1, 65)
+        db.set_order_utr(order_id, f"{500000000000 + i}")
+        order_ids.append(order_id)
+    # 90% exact, 5% wrong amount, 5% never paid, plus unrelated credits and a bank preamble
+    lines = ["Account Statement,,,,", "Account No: XXXX1234,,,,", "", "Txn Date,Narration,Ref No.,Withdrawal Amt.,Deposit Amt."]
+    for i in range(args.orders):
+        if i % 20 == 18:
+            continue
+        amount = "60.00" if i % 20 == 19 else "65.00"
+        lines.append(f"16/10/26,UPI/{500000000000 + i}/PAYMENT,UPI-{500000000000 + i},,{amount}")
+    lines += [f"16/10/26,UPI/{900000000000 + i}/OTHER,,,\"1,200.00\"" for i in range(args.orders // 10)]
+    sent = []
+
+    async def send_message(chat_id, text, **kwargs):
+        sent.append(chat_id)
+
+    fake_bot = SimpleNamespace(send_message=send_message)
+    start = time.perf_counter()
+    parser = bot.StatementParser()
+    parser.feed(lines)
+    parsed = time.perf_counter()
+    result = db.match_statement(parser.entries)
+    matched = time.perf_counter()
+    outcomes = await bot.deliver_matched(fake_bot, result['matched'])
+    done = time.perf_counter()
+    print(f"  parse {len(lines)} statement lines    {parsed - start:8.3f}s")
+    print(f"  match against {args.orders} orders   {matched - parsed:8.3f}s")
+    print(f"  deliver {len(result['matched'])} orders          {done - matched:8.3f}s")
+    print(f"  outcomes: {outcomes}, mismatched: {len(result['mismatched'])}, unknown: {result['unknown']}, missing: {result['missing']}")
+    print(f"  stats: {db.get_stats()}")
+
+
+def bench_reconcile(args):
+    asyncio.run(run_reconcile(args))
+
+
+def order_bytes(orders):
+    # each order plus the strings and code list it owns
+    total = 0
+    for order in orders:
+        values = order.values() if isinstance(order, dict) else [getattr(order, name) for name in bot.ORDER_FIELDS]
+        total += sys.getsizeof(order)
+        for value in values:
+            if isinstance(value, str):
+                total += sys.getsizeof(value)
+            elif isinstance(value, list):
+                total += sys.getsizeof(value) + sum(map(sys.getsizeof, value))
+    return total
+
+
+def deliver_orders(db, n):
+    order_ids = []
+    for i in range(n):
+        order_id = db.create_order(i, f"user{i}", "1000", 1, 65)
+        db.set_order_utr(order_id, f"{300000000000 + i}")
+        db.claim_codes(order_id)
+        db.mark_delivered(order_id)
+        order_ids.append(order_id)
+    return order_ids
+
+
+def lookup_all(db, order_ids):
+    for order_id in order_ids:
+        db.get_order(order_id)
+
+
+def bench_memory(args):
+    mb = 1024 * 1024
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "memory.db")
+        print(f"[{args.orders} delivered orders]")
+        db = bot.SimpleDB(bot.SQLiteBackend(path))
+        fill_codes(db, args.orders, 100000)
+        order_ids, _ = timed(f"create and deliver {args.orders}", deliver_orders, db, args.orders)
+        timed("flush to disk", db.backend.flush)
+        orders = list(db.orders.values())
+        print(f"  as dicts                         {order_bytes(o.to_dict() for o in orders) / mb:8.1f} MB")
+        print(f"  as Order objects                 {order_bytes(orders) / mb:8.1f} MB")
+        del orders
+        archive_at = time.time() + bot.ORDER_ARCHIVE_AGE + 1
+
+        def archive():
+            while order_ids := db.archive_orders(50000, archive_at):
+                db.backend.flush()
+                db.drop_archived(order_ids)
+        timed("archive all", archive)
+        print(f"  left in memory                   {order_bytes(db.orders.values()) / mb:8.1f} MB ({len(db.orders)} orders)")
+        stored = db.backend.reader.execute("SELECT SUM(LENGTH(data)) FROM order_archive").fetchone()[0]
+        sample = random.sample(order_ids, min(10000, args.orders))
+        raw = sum(len(json.dumps(db.get_order(oid).to_dict(), separators=(",", ":"))) for oid in sample)
+        print(f"  archived blobs                   {stored / mb:8.1f} MB ({stored / args.orders:.0f} B/order, "
+              f"{raw / len(sample):.0f} B as JSON)")
+        _, elapsed = timed(f"{len(sample)} archived lookups", lookup_all, db, sample)
+        print(f"  {'':<32} {elapsed / len(sample) * 1e6:8.1f} us each")
+        db.close()
+        db, _ = timed("restart", bot.SimpleDB, bot.SQLiteBackend(path))
+        print(f"  stats: {db.get_stats()}")
+        db.close()
+    print(f"[{args.codes} delivered codes]")
+    codes = [f"CODE-{i:012d}" for i in range(args.codes)]
+    strings = set(codes)
+    print(f"  set of strings                   {(sys.getsizeof(strings) + sum(map(sys.getsizeof, codes))) / mb:8.1f} MB")
+    del strings
+    digests, _ = timed("build DigestSet", bot.DigestSet, codes)
+    print(f"  DigestSet                        {(sys.getsizeof(digests.buckets) + sum(map(sys.getsizeof, digests.buckets))) / mb:8.1f} MB")
+    probes = random.sample(codes, 100000) + [f"MISS-{i}" for i in range(100000)]
+    _, elapsed = timed(f"{len(probes)} lookups", lambda: sum(code in digests for code in probes))
+    print(f"  {'':<32} {elapsed / len(probes) * 1e6:8.2f} us each")
+    timed("dump + reload", lambda: bot.DigestSet().frombytes(digests.tobytes()))
+
+
+def history(db, n, days):
+    # n orders spread evenly over the last `days` days, seven in ten delivered and the rest rejected
+    now = datetime.now()
+    step = days * 86400 / n
+    code_types = list(bot.CODE_TYPES)
+    for i in range(n):
+        created = now - timedelta(seconds=(n - i) * step)
+        code_type, quantity = code_types[i % len(code_types)], (1, 5, 10, 3)[i % 4]
+        order = bot.Order(i % 50000, f"user{i % 50000}", code_type, quantity, 65 * quantity, 'rejected', created.isoformat())
+        if i % 10 >= 3:
+            order.status, order.payment_verified, order.delivered = 'delivered', True, True
+            order.verified_at = (created + timedelta(seconds=60 + i % 3600)).isoformat()
+        order_id = f"ORD{created.strftime('%Y%m%d%H%M%S')}{i % 10000}-{i}"
+        db.orders[order_id] = order
+        db._index(order_id, order)
+
+
+def scan_totals(start, end):
+    paid = revenue = 0
+    for rows in bot.order_pages(start, end):
+        for _, order in rows:
+            if order.payment_verified:
+                paid += 1
+                revenue += order.amount
+    return paid, revenue
+
+
+async def export_csv(start, end):
+    chunks = [len(chunk) async for chunk in bot.OrdersCSV(start, end).read(None)]
+    return len(chunks), sum(chunks), max(chunks)
+
+
+def bench_report(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        db = bot.db = bot.SimpleDB(bot.SQLiteBackend(os.path.join(tmp, "report.db")))
+        timed(f"{args.orders} orders over {args.days} days", history, db, args.orders, args.days)
+        timed("backfill rollups", db._backfill_rollups)
+
+        def archive():
+            while order_ids := db.archive_orders(50000):
+                db.backend.flush()
+                db.drop_archived(order_ids)
+        timed(f"archive all but the last {bot.ORDER_ARCHIVE_AGE // 86400} days", archive)
+        print(f"  {len(db.orders)} orders left in memory")
+        end = date.today()
+        start = end - timedelta(days=args.days - 1)
+        report, _ = timed(f"report, {args.days} days", db.get_report, start, end)
+        print(f"  {'':<32} {report['total'][1]} paid, Rs.{report['total'][2]}")
+        timed("report, today", db.get_report, end, end)
+        (paid, revenue), _ = timed("same range by scanning orders", scan_totals, start, end)
+        print(f"  {'':<32} {paid} paid, Rs.{revenue}")
+        before = rss_mb()
+        (chunks, size, largest), _ = timed("stream CSV export", lambda: asyncio.run(export_csv(start, end)))
+        print(f"  {'':<32} {size / 1024 / 1024:.1f} MB in {chunks} chunks (largest {largest / 1024:.0f} KB), "
+              f"peak RSS +{rss_mb() - before:.1f} MB")
+        db.close()
+
+
+def bench_store(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        for name, backend in (("memory", None), ("sqlite", bot.SQLiteBackend(path))):
+            print(f"[{name}]")
+            db = bot.SimpleDB(backend)
+            timed(f"add {args.codes} codes", fill_codes, db, args.codes)
+            timed(f"create {args.orders} orders", fill_orders, db, args.orders)
+            timed(f"allocate {args.allocations} codes", allocate, db, args.allocations)
+            timed("flush to disk", db.backend.flush)
+            db.close()
+        db, _ = timed("reload everything above", bot.SimpleDB, bot.SQLiteBackend(path))
+        db.close()
+        print(f"[warm restart, {args.inventory} codes on disk]")
+        path = os.path.join(tmp, "inventory.db")
+        db = bot.SimpleDB(bot.SQLiteBackend(path))
+        fill_codes(db, args.inventory, 100000)
+        allocate(db, args.inventory // 100)
+        db.close()
+        db, _ = timed("load", bot.SimpleDB, bot.SQLiteBackend(path))
+        print(f"  stock: {db.get_stock_count()}")
+        db.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks for bot.py")
+    sub = parser.add_subparsers(dest="bench", required=True)
+    p = sub.add_parser("store", help="SimpleDB memory vs SQLite backend")
+    p.add_argument("--orders", type=int, default=100000)
+    p.add_argument("--codes", type=int, default=300000)
+    p.add_argument("--allocations", type=int, default=100000)
+    p.add_argument("--inventory", type=int, default=1000000)
+    p.set_defaults(func=bench_store)
+    p = sub.add_parser("inventory", help="code import/allocation at scale")
+    p.add_argument("--codes", type=int, default=1000000)
+    p.add_argument("--allocations", type=int, default=100000)
+    p.add_argument("--batch", type=int, default=10000)
+    p.set_defaults(func=bench_inventory)
+    p = sub.add_parser("verify", help="concurrent verify/reject callback stress test")
+    p.add_argument("--orders", type=int, default=1000)
+    p.add_argument("--taps", type=int, default=5, help="callbacks fired per order")
+    p.set_defaults(func=bench_verify)
+    p = sub.add_parser("load", help="end-to-end purchase journeys against a fake Bot API server")
+    p.add_argument("--users", type=int, default=500)
+    p.add_argument("--concurrency", type=int, default=100)
+    p.add_argument("--mode", choices=("polling", "webhook", "both"), default="both")
+    p.add_argument("--timeout", type=float, default=300)
+    p.set_defaults(func=bench_load)
+    p = sub.add_parser("reconcile", help="statement parsing, UTR matching and bulk delivery")
+    p.add_argument("--orders", type=int, default=10000)
+    p.set_defaults(func=bench_reconcile)
+    p = sub.add_parser("memory", help="order archival and delivered-code digests at scale")
+    p.add_argument("--orders", type=int, default=1000000)
+    p.add_argument("--codes", type=int, default=10000000)
+    p.set_defaults(func=bench_memory)
+    p = sub.add_parser("report", help="sales rollup reports and streaming CSV export")
+    p.add_argument("--orders", type=int, default=300000)
+    p.add_argument("--days", type=int, default=365)
+    p.set_defaults(func=bench_report)
+    p = sub.add_parser("users", help="user registry segments at scale")
+    p.add_argument("--users", type=int, default=1000000)
+    p.set_defaults(func=bench_users)
+    p = sub.add_parser("workers", help="throughput scaling of the multi-worker webhook mode")
+    p.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    p.add_argument("--users", type=int, default=500)
+    p.add_argument("--concurrency", type=int, default=100)
+    p.add_argument("--timeout", type=float, default=300)
+    p.set_defaults(func=bench_workers)
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,504 +1,2807 @@
-import asyncio
-import logging
-import os
-from datetime import datetime
-from aiogram import Bot, Dispatcher, Router, F
-from aiogram.types import Message, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, FSInputFile
-from aiogram.filters import Command
-from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.fsm.context import FSMContext
-from aiogram.fsm.state import State, StatesGroup
-
-BOT_TOKEN = os.getenv("BOT_TOKEN", "")
-ADMIN_USER_IDS = [int(os.getenv("ADMIN_ID", "1455619072"))]
-UPI_ID = os.getenv("UPI_ID", "")
-PAY_URL = "https://aaluu.pages.dev/"
-
-CODE_TYPES = {
-    "1000": {"display": "₹1000 Off", "pricing": {1: 65, 5: 300, 10: 620}},   # Single price updated to 60
-    "2000": {"display": "₹2000 Off", "pricing": {1: 180, 5: 670, 10: 1300}},
-    "500": {"display": "₹500 Off", "pricing": {1: 30, 5: 130, 10: 240}},
-}
-BROADCAST_USERS = set()
-
-TERMS_TEXT = """📜 Terms and Conditions
-1. All sales are final - No refunds
-2. Codes valid till 31 jan 2026
-3. Single-use codes only
-4. Payment within 15 minutes
-5. Delivery within 5-10 minutes
-6. No responsibility for invalid codes
-7. By proceeding you agree
-Delivery: Via Telegram
-Support: @animeverse23_requesting_bot"""
-
-class SimpleDB:
-    def __init__(self):
-        self.orders = {}
-        self.available_codes = {"1000": [], "2000": [], "500": []}
-        self.delivered_codes = set()
-    def create_order(self, user_id, username, code_type, quantity, amount):
-        order_id = f"ORD{datetime.now().strftime('%Y%m%d%H%M%S')}{user_id % 10000}"
-        self.orders[order_id] = {'user_id': user_id, 'username': username, 'code_type': code_type, 'quantity': quantity, 'amount': amount, 'status': 'pending', 'created_at': datetime.now().isoformat(), 'payment_verified': False, 'delivered': False}
-        return order_id
-    def verify_payment(self, order_id):
-        if order_id in self.orders:
-            self.orders[order_id]['status'] = 'paid'
-            self.orders[order_id]['payment_verified'] = True
-            self.orders[order_id]['verified_at'] = datetime.now().isoformat()
-            return True
-        return False
-    def get_available_codes(self, code_type, quantity):
-        code_list = self.available_codes.get(code_type, [])
-        if len(code_list) >= quantity:
-            codes = code_list[:quantity]
-            self.available_codes[code_type] = code_list[quantity:]
-            self.delivered_codes.update(codes)
-            return codes
-        return None
-    def add_codes_from_channel(self, code_type, codes_list):
-        new_codes = []
-        for code in codes_list:
-            if code not in self.delivered_codes and code not in self.available_codes[code_type]:
-                self.available_codes[code_type].append(code)
-                new_codes.append(code)
-        return len(new_codes)
-    def get_stock_count(self, code_type=None):
-        if code_type:
-            return len(self.available_codes.get(code_type, []))
-        return {k: len(v) for k, v in self.available_codes.items()}
-    def get_order(self, order_id): return self.orders.get(order_id)
-    def get_pending_orders(self): return {oid: o for oid, o in self.orders.items() if o['status'] == 'pending'}
-db = SimpleDB()
-
-class OrderStates(StatesGroup):
-    selecting_code_type = State()
-    waiting_for_terms = State()
-    selecting_quantity = State()
-    waiting_for_custom_quantity = State()
-    awaiting_payment = State()
-    waiting_for_proof = State()
-    verifying_payment = State()
-    broadcast_message = State()
-
-def get_code_type_keyboard():
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text=CODE_TYPES["1000"]["display"], callback_data="code_1000")],
-        [InlineKeyboardButton(text=CODE_TYPES["2000"]["display"], callback_data="code_2000")],
-        [InlineKeyboardButton(text=CODE_TYPES["500"]["display"], callback_data="code_500")]
-    ])
-
-def get_terms_keyboard():
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="✅ Accept", callback_data="terms_accept"),
-         InlineKeyboardButton(text="❌ Decline", callback_data="terms_decline")]
-    ])
-
-def get_quantity_keyboard(code_type):
-    pricing = CODE_TYPES[code_type]["pricing"]
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text=f"1 Code - Rs.{pricing[1]}", callback_data="qty_1"),
-         InlineKeyboardButton(text=f"5 Codes - Rs.{pricing[5]}", callback_data="qty_5")],
-        [InlineKeyboardButton(text=f"10 Codes - Rs.{pricing[10]}", callback_data="qty_10"),
-         InlineKeyboardButton(text="📝 Custom", callback_data="qty_custom")],
-        [InlineKeyboardButton(text="📦 Check Stock", callback_data="check_stock")],
-        [InlineKeyboardButton(text="🔙 Cancel", callback_data="cancel")]
-    ])
-
-def get_payment_keyboard(order_id):
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="💸 Pay Here", url=PAY_URL)],
-        [InlineKeyboardButton(text="📤 Send UTR/Screenshot", callback_data=f"sendproof_{order_id}")],
-        [InlineKeyboardButton(text="❌ Cancel Order", callback_data="cancel_order")]
-    ])
-
-def get_admin_verify_keyboard(order_id):
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="✅ Confirm Payment", callback_data=f"verify_{order_id}"),
-         InlineKeyboardButton(text="❌ Reject", callback_data=f"reject_{order_id}")]
-    ])
-
-router = Router()
-
-@router.message(Command("start"))
-async def cmd_start(message: Message, state: FSMContext):
-    BROADCAST_USERS.add(message.from_user.id)
-    stocks = db.get_stock_count()
-    stock_text = "\n".join(f"{CODE_TYPES[k]['display']}: {v}" for k, v in stocks.items())
-    await message.answer(
-        "🛍️ Welcome to Discount Codes Store!\n\n"
-        f"📦 Stock:\n{stock_text}\n"
-        f"🌐 Pay Online: {PAY_URL}\n"
-        "💳 Payment via UPI\n"
-        "⚡ Instant delivery after verification\n"
-        "Use /buy to start.\nSupport: @animeverse23_requesting_bot"
-    )
-
-@router.message(Command("help"))
-async def cmd_help(message: Message, state: FSMContext):
-    if message.from_user.id in ADMIN_USER_IDS:
-        await message.answer(
-            "📖 ADMIN HELP MENU\n"
-            "Admin Commands:\n"
-            "/addcode code_type CODE1[\\nCODE2...]\n"
-            "/stock - Inventory\n"
-            "/pending - View pending orders\n"
-            "/setqr - Update UPI QR code\n"
-            "/sendall - Broadcast to all users\n"
-            "Customer Commands:\n"
-            "/start - Welcome\n/buy - Buy codes\n/stock - Stock\n/help - Help\n/cancel - Cancel action"
-        )
-    else:
-        await message.answer(
-            "Customer Commands:\n"
-            "/start - Welcome\n/buy - Buy codes\n/stock - Stock\n/help - Help"
-        )
-
-@router.message(Command("buy"))
-async def cmd_buy(message: Message, state: FSMContext):
-    BROADCAST_USERS.add(message.from_user.id)
-    stocks = db.get_stock_count()
-    in_stock = any(qty > 0 for qty in stocks.values())
-    if not in_stock:
-        await message.answer(
-            "❌ Out of Stock\nNo codes available now.\nPlease check later or contact @animeverse23_requesting_bot"
-        )
-        return
-    await message.answer("Select code type:", reply_markup=get_code_type_keyboard())
-    await state.set_state(OrderStates.selecting_code_type)
-
-@router.callback_query(F.data.startswith("code_"))
-async def code_type_selected(callback: CallbackQuery, state: FSMContext):
-    code_type = callback.data.split("_")[1]
-    await state.update_data(code_type=code_type)
-    await callback.message.edit_text(
-        TERMS_TEXT, reply_markup=get_terms_keyboard()
-    )
-    await state.set_state(OrderStates.waiting_for_terms)
-    await callback.answer()
-
-@router.callback_query(F.data == "terms_accept")
-async def terms_accepted(callback: CallbackQuery, state: FSMContext):
-    BROADCAST_USERS.add(callback.from_user.id)
-    data = await state.get_data()
-    code_type = data.get("code_type")
-    if db.get_stock_count(code_type) == 0:
-        await callback.message.edit_text(
-            "❌ Out of Stock\nNo codes available now.\nPlease check later or contact @animeverse23_requesting_bot"
-        )
-        await state.clear()
-        await callback.answer()
-        return
-    await callback.message.edit_text(
-        f"✅ Terms Accepted\n\n📦 {CODE_TYPES[code_type]['display']} Stock: {db.get_stock_count(code_type)} codes\nSelect quantity:",
-        reply_markup=get_quantity_keyboard(code_type)
-    )
-    await state.set_state(OrderStates.selecting_quantity)
-    await callback.answer()
-
-@router.callback_query(F.data == "terms_decline")
-async def terms_declined(callback: CallbackQuery, state: FSMContext):
-    await callback.message.edit_text("❌ You must accept the terms.\nUse /buy to start again.")
-    await state.clear()
-    await callback.answer()
-
-@router.callback_query(F.data == "check_stock")
-async def check_stock(callback: CallbackQuery, state: FSMContext):
-    data = await state.get_data()
-    code_type = data.get("code_type")
-    stock = db.get_stock_count(code_type)
-    await callback.answer(f"📦 Available: {stock} codes", show_alert=True)
-
-@router.callback_query(F.data == "cancel")
-async def cancel_action(callback: CallbackQuery, state: FSMContext):
-    await callback.message.edit_text("❌ Action cancelled\nUse /buy to start again")
-    await state.clear()
-    await callback.answer("Cancelled")
-
-@router.callback_query(F.data.startswith("qty_"))
-async def quantity_selected(callback: CallbackQuery, state: FSMContext):
-    data = await state.get_data()
-    code_type = data.get("code_type")
-    qty_data = callback.data.split("_")[1]
-    if qty_data == "custom":
-        await callback.message.edit_text(
-            f"📝 Custom Quantity\nEnter codes you want ({CODE_TYPES[code_type]['display']}, per code rates apply).\nSend /cancel to go back."
-        )
-        await state.set_state(OrderStates.waiting_for_custom_quantity)
-        await callback.answer()
-        return
-    quantity = int(qty_data)
-    pricing = CODE_TYPES[code_type]["pricing"]
-    amount = pricing.get(quantity, quantity * pricing[1])
-    if db.get_stock_count(code_type) < quantity:
-        await callback.answer(
-            f"❌ Not enough stock! Only {db.get_stock_count(code_type)} available",
-            show_alert=True
-        )
-        return
-    order_id = db.create_order(
-        callback.from_user.id, callback.from_user.username or callback.from_user.first_name,
-        code_type, quantity, amount
-    )
-    await state.update_data(order_id=order_id, quantity=quantity, amount=amount)
-    msg = (
-        "📄 PAYMENT INVOICE\n"
-        f"Order ID: {order_id}\nType: {CODE_TYPES[code_type]['display']}\n"
-        f"Customer: {callback.from_user.full_name} (@{callback.from_user.username or 'none'})\n"
-        f"Quantity: {quantity} codes\nAmount: Rs.{amount}\n"
-        f"Pay to: {UPI_ID} (copy and pay via any UPI app) or click 'Pay Here' below.\n"
-        "After payment send UTR/Screenshot."
-    )
-    await callback.message.edit_text(msg)
-    await callback.message.answer(
-        "💸 Choose your UPI app below to pay instantly:",
-        reply_markup=get_payment_keyboard(order_id)
-    )
-    await state.set_state(OrderStates.awaiting_payment)
-    await callback.answer("Invoice generated!")
-
-@router.message(OrderStates.waiting_for_custom_quantity)
-async def custom_quantity_entered(message: Message, state: FSMContext):
-    data = await state.get_data()
-    code_type = data.get("code_type")
-    try:
-        quantity = int(message.text)
-        if quantity < 1 or quantity > 50:
-            await message.answer("❌ Min 1, Max 50 codes/order.")
-            return
-        if db.get_stock_count(code_type) < quantity:
-            await message.answer(f"❌ Only {db.get_stock_count(code_type)} codes available")
-            return
-        pricing = CODE_TYPES[code_type]["pricing"]
-        amount = pricing[1] * quantity
-        order_id = db.create_order(
-            message.from_user.id, message.from_user.username or message.from_user.first_name,
-            code_type, quantity, amount
-        )
-        await state.update_data(order_id=order_id, quantity=quantity, amount=amount)
-        msg = (
-            "📄 PAYMENT INVOICE\n"
-            f"Order: {order_id}\nType: {CODE_TYPES[code_type]['display']}\n"
-            f"Qty: {quantity}\nAmt: Rs.{amount}\n"
-            f"Pay to: {UPI_ID} (copy and pay via any UPI app) or click 'Pay Here' below.\n"
-            "After payment send UTR/Screenshot."
-        )
-        await message.answer(msg)
-        # Admin Notification for custom quantity order
-        for admin_id in ADMIN_USER_IDS:
-            await message.bot.send_message(
-                admin_id,
-                f"🆕 Custom Quantity Order\n"
-                f"User: @{message.from_user.username or message.from_user.full_name} (id={message.from_user.id})\n"
-                f"Type: {CODE_TYPES[code_type]['display']}\n"
-                f"Qty: {quantity} | Amt: Rs.{amount}\n"
-                f"Order ID: {order_id}\n"
-                f"Waiting for payment!"
-            )
-        await message.answer(
-            "💸 Choose your UPI app below to pay instantly:",
-            reply_markup=get_payment_keyboard(order_id)
-        )
-        await state.set_state(OrderStates.awaiting_payment)
-    except ValueError:
-        await message.answer("❌ Please enter a valid number")
-
-@router.callback_query(F.data.startswith("sendproof_"))
-async def receive_proof_prompt(callback: CallbackQuery, state: FSMContext):
-    order_id = callback.data.split("_", 1)[1]
-    await state.update_data(order_id=order_id)
-    await callback.message.answer(
-        "📤 Please send your payment screenshot as a photo or send the UTR/reference ID as text."
-    )
-    await state.set_state(OrderStates.waiting_for_proof)
-    await callback.answer("Send your UTR or screenshot below.")
-
-@router.message(OrderStates.waiting_for_proof)
-async def handle_payment_proof(message: Message, state: FSMContext):
-    data = await state.get_data()
-    order_id = data.get('order_id')
-    user = message.from_user
-    sent = False
-    approve_keyboard = get_admin_verify_keyboard(order_id)
-    if message.photo:
-        caption = (
-            f"📤 Payment screenshot for Order: {order_id}\n"
-            f"User: @{user.username or 'none'} ({user.full_name}, id={user.id})"
-        )
-        for admin_id in ADMIN_USER_IDS:
-            await message.bot.send_photo(admin_id, message.photo[-1].file_id, caption=caption, reply_markup=approve_keyboard)
-        await message.answer("✅ Screenshot sent to admin! You will get the code after verification.")
-        sent = True
-    elif message.text:
-        caption = (
-            f"📤 UTR/Reference for Order: {order_id}\n"
-            f"User: @{user.username or 'none'} ({user.full_name}, id={user.id})\n"
-            f"UTR/Ref: {message.text}"
-        )
-        for admin_id in ADMIN_USER_IDS:
-            await message.bot.send_message(admin_id, caption, reply_markup=approve_keyboard)
-        await message.answer("✅ UTR sent to admin! You will get the code after verification.")
-        sent = True
-    if sent:
-        await state.clear()
-
-@router.callback_query(F.data.startswith("verify_"))
-async def admin_verify_payment(callback: CallbackQuery, state: FSMContext):
-    if callback.from_user.id not in ADMIN_USER_IDS:
-        await callback.answer("❌ Unauthorized", show_alert=True)
-        return
-    order_id = callback.data.split("_", 1)[1]
-    order = db.get_order(order_id)
-    if not order:
-        await callback.answer("❌ Order not found", show_alert=True)
-        return
-    if order.get('delivered'):
-        await callback.answer("⚠️ Codes already sent for this order.", show_alert=True)
-        return
-    ct = order['code_type']
-    if db.get_stock_count(ct) < order['quantity']:
-        await callback.answer("❌ Not enough codes!", show_alert=True)
-        await callback.message.edit_text(f"❌ INSUFFICIENT STOCK for order {order_id}")
-        return
-    codes = db.get_available_codes(ct, order['quantity'])
-    if not codes:
-        await callback.answer("❌ Failed to deliver codes!", show_alert=True)
-        return
-    db.verify_payment(order_id)
-    order['delivered'] = True
-    user_id = order['user_id']
-    codes_text = "\n".join([f"{i+1}. {code}" for i, code in enumerate(codes)])
-    await callback.bot.send_message(
-        user_id,
-        f"✅ PAYMENT VERIFIED!\nOrder: {order_id}\nType: {CODE_TYPES[ct]['display']}\n"
-        f"Your Codes:\n{codes_text}\nThank you!"
-    )
-    await callback.message.edit_text(
-        f"✅ Codes delivered for {order_id}.\nCustomer notified."
-    )
-    await callback.answer("✅ Codes delivered!", show_alert=True)
-
-@router.callback_query(F.data.startswith("reject_"))
-async def admin_reject_payment(callback: CallbackQuery, state: FSMContext):
-    if callback.from_user.id not in ADMIN_USER_IDS:
-        await callback.answer("❌ Unauthorized", show_alert=True)
-        return
-    order_id = callback.data.split("_", 1)[1]
-    order = db.get_order(order_id)
-    if order:
-        await callback.bot.send_message(
-            order['user_id'],
-            f"❌ Payment not verified.\nOrder: {order_id}\nContact admin: @animeverse23_requesting_bot with your payment details."
-        )
-    await callback.message.edit_text(f"❌ Order {order_id} rejected.\nCustomer notified.")
-    await callback.answer("Rejected")
-
-@router.message(Command("addcode"))
-async def add_code(message: Message, state: FSMContext):
-    if message.from_user.id not in ADMIN_USER_IDS:
-        await message.answer("❌ Admin only command")
-        return
-    args = message.text.split(None, 2)
-    if len(args) < 3 or args[1] not in CODE_TYPES:
-        await message.answer(
-            "Usage: /addcode [1000|2000|500] CODE1\\nCODE2\\n... (paste one per line after a space!)"
-        )
-        return
-    code_type = args[1]
-    codes_list = [c.strip() for c in args[2].split('\n') if c.strip()]
-    added = db.add_codes_from_channel(code_type, codes_list)
-    await message.answer(
-        f"✅ Added: {added} codes to {CODE_TYPES[code_type]['display']}. Stock: {db.get_stock_count(code_type)}."
-    )
-
-@router.message(Command("stock"))
-async def check_stock(message: Message, state: FSMContext):
-    stocks = db.get_stock_count()
-    stock_text = "\n".join(f"{CODE_TYPES[k]['display']}: {v}" for k, v in stocks.items())
-    if message.from_user.id in ADMIN_USER_IDS:
-        total = len(db.orders)
-        paid = len([o for o in db.orders.values() if o['payment_verified']])
-        pending = total - paid
-        await message.answer(
-            f"📊 INVENTORY & SALES\n{stock_text}\n"
-            f"Orders: {total} | Paid: {paid} | Pending: {pending}\n"
-            f"Use /pending to view waiting for verification."
-        )
-    else:
-        await message.answer(f"Stock:\n{stock_text}\nUse /buy to order.")
-
-@router.message(Command("pending"))
-async def pending_orders(message: Message, state: FSMContext):
-    if message.from_user.id not in ADMIN_USER_IDS:
-        await message.answer("❌ Admin only command")
-        return
-    pending = db.get_pending_orders()
-    if not pending:
-        await message.answer("✅ No pending orders.")
-        return
-    text = f"⏳ Pending Orders ({len(pending)}):\n"
-    for oid, o in pending.items():
-        text += (
-            f"Order: {oid}\n"
-            f"User: @{o['username']}\n"
-            f"Type: {CODE_TYPES[o['code_type']]['display']}\n"
-            f"Qty: {o['quantity']} | Amt: Rs.{o['amount']}\n"
-            f"Time: {o['created_at'][:16]}\n\n"
-        )
-    await message.answer(text)
-
-@router.message(Command("sendall"))
-async def broadcast_start(message: Message, state: FSMContext):
-    if message.from_user.id not in ADMIN_USER_IDS:
-        await message.answer("❌ Admin only command")
-        return
-    await state.set_state(OrderStates.broadcast_message)
-    await message.answer("Send the message (text or photo) you want to broadcast to all users:")
-
-@router.message(OrderStates.broadcast_message)
-async def broadcast_message(message: Message, state: FSMContext):
-    await state.clear()
-    users = BROADCAST_USERS - set(ADMIN_USER_IDS)
-    failed = 0
-    success = 0
-    for user_id in users:
-        try:
-            if message.text:
-                await message.bot.send_message(user_id, message.text)
-            elif message.photo:
-                await message.bot.send_photo(user_id, message.photo[-1].file_id, caption=message.caption or '')
-            success += 1
-        except Exception:
-            failed += 1
-    await message.answer(f"Broadcast sent. Success: {success}, Failed: {failed}")
-
-@router.message(Command("setqr"))
-async def set_qr(message: Message, state: FSMContext):
-    if message.from_user.id not in ADMIN_USER_IDS:
-        await message.answer("❌ Admin only command")
-        return
-    await message.answer("📸 Send your UPI QR image now. (As photo, not file)")
-
-@router.message(F.photo)
-async def receive_qr(message: Message, state: FSMContext):
-    if message.from_user.id not in ADMIN_USER_IDS:
-        return
-    try:
-        photo = message.photo[-1]
-        file = await message.bot.get_file(photo.file_id)
-        await message.bot.download_file(file.file_path, "upi_qr.jpg")
-        await message.answer("✅ QR Code updated and will be sent to new buyers!")
-    except Exception as e:
-        await message.answer(f"❌ QR upload failed: {str(e)}")
-
-async def main():
-    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-    bot = Bot(token=BOT_TOKEN)
-    dp = Dispatcher(storage=MemoryStorage())
-    dp.include_router(router)
-    print("🤖 Bot started!")
-    await dp.start_polling(bot)
-
-if __name__ == "__main__":
-    asyncio.run(main())
-
+import asyncio
+import codecs
+import csv
+import io
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import re
+import signal
+import sqlite3
+import threading
+import time
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from dataclasses import dataclass, fields
+from hashlib import blake2b
+from multiprocessing.managers import BaseManager
+from functools import lru_cache
+from itertools import compress, islice, takewhile
+from operator import and_, not_
+from datetime import date, datetime, timedelta
+from urllib.parse import quote, urlencode
+from aiohttp import ClientError, ClientSession, ClientTimeout, web
+from aiogram import BaseMiddleware, Bot, Dispatcher, Router, F
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import Message, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, FSInputFile, BufferedInputFile, InputFile
+from aiogram.filters import Command
+from aiogram.exceptions import TelegramAPIError, TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+import qr
+
+BOT_TOKEN = os.getenv("BOT_TOKEN", "")
+# ADMIN_IDS takes a comma-separated list of verifiers; ADMIN_ID is kept for single-admin setups
+ADMIN_USER_IDS = [int(x) for x in (os.getenv("ADMIN_IDS") or os.getenv("ADMIN_ID", "1455619072")).split(",") if x.strip()]
+ADMIN_NOTIFY_WORKERS = 4
+ORDER_LOCK_STRIPES = 256
+# >0 groups new-order notifications into one digest per window (seconds)
+ADMIN_DIGEST_WINDOW = int(os.getenv("ADMIN_DIGEST_WINDOW", "0"))
+UPI_ID = os.getenv("UPI_ID", "")
+# Invoices carry a UPI-intent QR for UPI_ID with the amount prefilled; without UPI_ID the
+# static image uploaded via /setqr is attached instead. By default QRs are per amount only
+# (the order id is in the invoice text), so repeat amounts are served from the caches below;
+# a UPI_QR_NOTE such as "Order {order_id}" makes every QR unique and renders each one afresh.
+UPI_PAYEE_NAME = os.getenv("UPI_PAYEE_NAME", "")
+UPI_QR_NOTE = os.getenv("UPI_QR_NOTE", "")
+UPI_QR_FILE = "upi_qr.jpg"
+QR_CACHE_SIZE = 256
+PAY_URL = "https://aaluu.pages.dev/"
+# BOT_MODE=webhook serves updates over HTTP instead of long polling;
+# BOT_API_URL points the client at a self-hosted or fake Bot API server
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+BOT_API_URL = os.getenv("BOT_API_URL", "")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_DRAIN_TIMEOUT = 25
+# BOT_WORKERS>1 (webhook mode) runs that many worker processes on WEBHOOK_PORT+1.. behind a routing
+# master that owns the shop db; BOT_SHARED_STORE is set by the master for its workers only
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "1"))
+BOT_SHARED_STORE = os.getenv("BOT_SHARED_STORE", "")
+WORKER_READY_TIMEOUT = 60
+HASH_RING_REPLICAS = 64
+# how often workers check whether another worker ran /reload
+CATALOG_SYNC_INTERVAL = 2
+# Prometheus text metrics: served on the webhook app, or on METRICS_PORT when polling (0 = off)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+VERIFY_BUCKETS = (60, 300, 900, 1800, 3600, 4 * 3600, 24 * 3600)
+
+# Catalog and pricing tiers live in catalog.json; /reload re-reads it without a restart
+CATALOG_PATH = os.getenv("CATALOG_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "catalog.json"))
+
+def load_catalog(path=CATALOG_PATH):
+    with open(path, encoding="utf-8") as f:
+        raw = json.load(f)["code_types"]
+    catalog = {}
+    for code_type, item in raw.items():
+        pricing = {int(q): int(p) for q, p in item["pricing"].items()}
+        # code types are embedded in "_"-separated callback data
+        if "_" in code_type or 1 not in pricing or min(pricing) < 1:
+            raise ValueError(f"Invalid catalog entry {code_type!r}: needs a 1-code price, positive pack sizes and no '_' in its key")
+        catalog[code_type] = {"display": item["display"], "pricing": dict(sorted(pricing.items()))}
+    return catalog
+
+CODE_TYPES = load_catalog()
+
+def display_name(code_type):
+    # orders can outlive their code type's catalog entry after a /reload
+    return CODE_TYPES[code_type]["display"] if code_type in CODE_TYPES else code_type
+
+def pricing_tier(code_type, quantity):
+    # pack sizes listed in the catalog have their own price, anything else is sold per code (tier 1)
+    return quantity if quantity in CODE_TYPES.get(code_type, {}).get("pricing", ()) else 1
+DB_PATH = os.getenv("DB_PATH", "shop.db")
+FSM_DB_PATH = os.getenv("FSM_DB_PATH", "fsm.db")
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))
+FSM_TTL = int(os.getenv("FSM_TTL", str(24 * 60 * 60)))
+FSM_FLUSH_INTERVAL = 1.0
+CODE_IMPORT_BATCH = 5000
+CODE_IMPORT_REPORT_INTERVAL = 2
+# Codes are held for the 15-minute payment window from TERMS_TEXT
+RESERVATION_TTL = int(os.getenv("RESERVATION_TTL", str(15 * 60)))
+RESERVATION_REAP_INTERVAL = 30
+RESERVATION_REAP_BATCH = 500
+# delivered, rejected and cancelled orders older than ORDER_ARCHIVE_AGE leave memory for the
+# compressed order_archive table and are read back on lookup (0 = never archive; without
+# DB_PATH there is no disk to archive to, so orders always stay in memory)
+ORDER_ARCHIVE_AGE = int(os.getenv("ORDER_ARCHIVE_AGE", str(7 * 24 * 60 * 60)))
+ORDER_ARCHIVE_INTERVAL = 60 * 60
+ORDER_ARCHIVE_BATCH = 2000
+# a returning user's last_seen is only re-persisted once it moves by this much (seconds)
+USER_SEEN_RESOLUTION = 300
+USER_SEGMENTS = ('all', 'buyers', 'never', 'active', 'inactive', 'bought')
+PENDING_PAGE_SIZE = 5
+PENDING_AGE_FILTERS = (0, 15 * 60, 60 * 60, 24 * 60 * 60)
+# Telegram allows ~30 msgs/sec globally and ~1 msg/sec per chat; stay under both
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "20"))
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_RETRIES = 3
+# /reconcile: statement matches are delivered RECONCILE_CONCURRENCY at a time under BROADCAST_RATE;
+# at most RECONCILE_REVIEW_LIMIT mismatches are posted back as individual review cards
+RECONCILE_CONCURRENCY = 20
+RECONCILE_REVIEW_LIMIT = 20
+BROADCAST_REPORT_INTERVAL = 3
+# /report: longest date range, and orders fetched per page while streaming the CSV export
+REPORT_MAX_DAYS = 366
+EXPORT_PAGE_SIZE = 1000
+BROADCAST_JOB_FILE = os.getenv("BROADCAST_JOB_FILE", "broadcast_job.json")
+
+TERMS_TEXT = """📜 Terms and Conditions
+1. All sales are final - No refunds
+2. Codes valid till 31 jan 2026
+3. Single-use codes only
+4. Payment within 15 minutes
+5. Delivery within 5-10 minutes
+6. No responsibility for invalid codes
+7. By proceeding you agree
+Delivery: Via Telegram
+Support: @animeverse23_requesting_bot"""
+
+class MemoryBackend:
+    def __init__(self): self.archive = {}
+    def load(self): return {}, {}, set()
+    def save_order(self, order_id, order): pass
+    def archive_orders(self, rows): self.archive.update(rows)
+    def load_archived(self, order_id): return self.archive.get(order_id)
+    def load_archived_user(self, user_id): return {oid: o for oid, o in self.archive.items() if o['user_id'] == user_id}
+    def find_archived_utr(self, utr):
+        owners = [oid for oid, o in self.archive.items() if o.get('utr') == utr]
+        return min(owners, key=lambda oid: self.archive[oid]['status'] in ('rejected', 'cancelled'), default=None)
+    def archive_stats(self): return 0, 0, 0
+    def iter_archived(self): return iter(self.archive.values())
+    def load_archived_range(self, low, high, after, limit):
+        ids = sorted(oid for oid in self.archive if low <= oid < high and oid > after)[:limit]
+        return [(oid, self.archive[oid]) for oid in ids]
+    def load_rollups(self): return []
+    def save_rollups(self, rows): pass
+    def add_codes(self, code_type, codes): pass
+    def mark_delivered(self, codes, code_type=None): pass
+    def load_users(self): return {}, []
+    def save_user(self, row): pass
+    def save_user_columns(self, columns): pass
+    def flush(self): pass
+    def close(self): pass
+
+# Write-behind SQLite (WAL) store: callers only enqueue, a writer thread commits in batches.
+# Inventory changes go to an append-only journal that is periodically compacted into a
+# snapshot (one row per code type), so startup replays a handful of rows instead of one per code.
+class SQLiteBackend:
+    COMPACT_EVERY = 20000
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS orders (order_id TEXT PRIMARY KEY, data TEXT NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS code_journal (seq INTEGER PRIMARY KEY AUTOINCREMENT, op TEXT NOT NULL, "
+        "code_type TEXT, codes TEXT NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, first_seen INTEGER NOT NULL, "
+        "last_seen INTEGER NOT NULL, purchases INTEGER NOT NULL, spend INTEGER NOT NULL, "
+        "blocked INTEGER NOT NULL, bought TEXT NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS user_columns (name TEXT PRIMARY KEY, data BLOB NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS order_archive (order_id TEXT PRIMARY KEY, user_id INTEGER NOT NULL, "
+        "status TEXT NOT NULL, utr TEXT, paid INTEGER NOT NULL, amount INTEGER NOT NULL, data BLOB NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS order_archive_user ON order_archive (user_id)",
+        "CREATE INDEX IF NOT EXISTS order_archive_utr ON order_archive (utr) WHERE utr IS NOT NULL",
+        "CREATE TABLE IF NOT EXISTS rollups (level TEXT NOT NULL, bucket TEXT NOT NULL, code_type TEXT NOT NULL, "
+        "tier INTEGER NOT NULL, invoices INTEGER NOT NULL, paid INTEGER NOT NULL, revenue INTEGER NOT NULL, "
+        "verify_seconds INTEGER NOT NULL, PRIMARY KEY (level, bucket, code_type, tier))",
+    )
+    # preset dictionary for the archive's zlib streams: each order is a few hundred bytes of
+    # JSON, too short for zlib to learn the repeated keys from the record alone
+    ARCHIVE_ZDICT = json.dumps({
+        'user_id': 0, 'username': '', 'code_type': '', 'quantity': 1, 'amount': 0, 'status': 'delivered',
+        'created_at': '2026-01-01T00:00:00.000000', 'payment_verified': True, 'delivered': True, 'codes': [],
+        'verified_at': '2026-01-01T00:00:00.000000', 'utr': '',
+    }, separators=(",", ":")).encode()
+    def __init__(self, path):
+        self.path = path
+        self.queue = queue.SimpleQueue()
+        conn = self._connect()
+        for stmt in self.SCHEMA:
+            conn.execute(stmt)
+        conn.commit()
+        conn.close()
+        self.writer = threading.Thread(target=self._write_loop, name="db-writer", daemon=True)
+        self.writer.start()
+        self.reader = self._connect()
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+    def load(self):
+        conn = self._connect()
+        rows = conn.execute("SELECT order_id, data FROM orders ORDER BY rowid").fetchall()
+        # one big decode is much cheaper than a json.loads call per row
+        orders = dict(zip((r[0] for r in rows), json.loads("[" + ",".join(r[1] for r in rows) + "]")))
+        available, delivered = self._replay(conn)
+        conn.close()
+        return orders, available, delivered
+    def load_users(self):
+        # the registry is stored as one blob per column on clean shutdown; `users` holds the
+        # rows changed since then, so a restart reads a few blobs plus the recent rows
+        conn = self._connect()
+        columns = dict(conn.execute("SELECT name, data FROM user_columns"))
+        rows = conn.execute("SELECT user_id, first_seen, last_seen, purchases, spend, blocked, bought FROM users").fetchall()
+        conn.close()
+        return columns, [(*r[:6], json.loads(r[6])) for r in rows]
+    def _pack(self, order):
+        packer = zlib.compressobj(9, zdict=self.ARCHIVE_ZDICT)
+        return packer.compress(json.dumps(order, separators=(",", ":")).encode()) + packer.flush()
+    def _unpack(self, data):
+        unpacker = zlib.decompressobj(zdict=self.ARCHIVE_ZDICT)
+        return json.loads(unpacker.decompress(data) + unpacker.flush())
+    def load_archived(self, order_id):
+        row = self.reader.execute("SELECT data FROM order_archive WHERE order_id = ?", (order_id,)).fetchone()
+        return self._unpack(row[0]) if row else None
+    def load_archived_user(self, user_id):
+        rows = self.reader.execute("SELECT order_id, data FROM order_archive WHERE user_id = ? ORDER BY rowid", (user_id,))
+        return {oid: self._unpack(data) for oid, data in rows}
+    def find_archived_utr(self, utr):
+        # a live owner (anything but rejected/cancelled) wins over dead ones
+        row = self.reader.execute(
+            "SELECT order_id FROM order_archive WHERE utr = ? ORDER BY status IN ('rejected', 'cancelled') LIMIT 1", (utr,)
+        ).fetchone()
+        return row[0] if row else None
+    def iter_archived(self):
+        for (data,) in self.reader.execute("SELECT data FROM order_archive"):
+            yield self._unpack(data)
+    def load_archived_range(self, low, high, after, limit):
+        # order ids start with their creation time, so a date range is an id range
+        rows = self.reader.execute(
+            "SELECT order_id, data FROM order_archive WHERE order_id >= ? AND order_id < ? AND order_id > ? "
+            "ORDER BY order_id LIMIT ?", (low, high, after, limit)
+        )
+        return [(oid, self._unpack(data)) for oid, data in rows]
+    def load_rollups(self):
+        conn = self._connect()
+        rows = conn.execute("SELECT * FROM rollups").fetchall()
+        conn.close()
+        return rows
+    def archive_stats(self):
+        return self.reader.execute("SELECT COUNT(*), COALESCE(SUM(paid), 0), COALESCE(SUM(paid * amount), 0) FROM order_archive").fetchone()
+    @staticmethod
+    def _replay(conn):
+        # codes are only journaled once (SimpleDB dedups), so adds can be extended blindly;
+        # compaction stores every delivered code as one digests row, which never affects stock
+        available, delivered, taken = {}, DigestSet(), {}
+        for op, code_type, codes in conn.execute("SELECT op, code_type, codes FROM code_journal ORDER BY seq"):
+            if op == 'digests':
+                delivered.frombytes(codes)
+                continue
+            codes = codes.split("\n")
+            if op == 'add':
+                available.setdefault(code_type, []).extend(codes)
+            elif op == 'deliver':
+                delivered.update(codes)
+                if code_type is not None:
+                    taken.setdefault(code_type, set()).update(codes)
+        for code_type, codes in taken.items():
+            if code_type in available:
+                available[code_type] = [c for c in available[code_type] if c not in codes]
+        return available, delivered
+    def _compact(self, conn):
+        available, delivered = self._replay(conn)
+        rows = [('add', k, "\n".join(v)) for k, v in available.items() if v]
+        if delivered:
+            rows.append(('digests', None, delivered.tobytes()))
+        with conn:
+            conn.execute("DELETE FROM code_journal")
+            conn.executemany("INSERT INTO code_journal (op, code_type, codes) VALUES (?, ?, ?)", rows)
+    def save_order(self, order_id, order): self.queue.put(('order', order_id, order.to_dict()))
+    def archive_orders(self, rows): self.queue.put(('archive', rows))
+    def add_codes(self, code_type, codes):
+        if codes:
+            self.queue.put(('journal', 'add', code_type, codes))
+    def mark_delivered(self, codes, code_type=None):
+        if codes:
+            self.queue.put(('journal', 'deliver', code_type, codes))
+    def save_user(self, row): self.queue.put(('user', row))
+    def save_rollups(self, rows): self.queue.put(('rollups', rows))
+    def save_user_columns(self, columns): self.queue.put(('user_columns', columns))
+    def flush(self):
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait()
+    def close(self):
+        self.queue.put(None)
+        self.writer.join()
+        self.reader.close()
+    def _write_loop(self):
+        conn = self._connect()
+        journaled = 0
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            waiters = []
+            try:
+                with conn:
+                    for op in batch:
+                        if op is None:
+                            running = False
+                        elif isinstance(op, threading.Event):
+                            waiters.append(op)
+                        elif op[0] == 'order':
+                            conn.execute(
+                                "INSERT INTO orders (order_id, data) VALUES (?, ?) "
+                                "ON CONFLICT(order_id) DO UPDATE SET data = excluded.data", (op[1], json.dumps(op[2]))
+                            )
+                        elif op[0] == 'archive':
+                            conn.executemany("INSERT OR REPLACE INTO order_archive VALUES (?, ?, ?, ?, ?, ?, ?)", [
+                                (oid, o['user_id'], o['status'], o.get('utr'), int(o['payment_verified']), o['amount'], self._pack(o))
+                                for oid, o in op[1]
+                            ])
+                            conn.executemany("DELETE FROM orders WHERE order_id = ?", [(oid,) for oid, _ in op[1]])
+                        elif op[0] == 'rollups':
+                            conn.executemany("INSERT OR REPLACE INTO rollups VALUES (?, ?, ?, ?, ?, ?, ?, ?)", op[1])
+                        elif op[0] == 'user':
+                            conn.execute("INSERT OR REPLACE INTO users VALUES (?, ?, ?, ?, ?, ?, ?)", (*op[1][:6], json.dumps(op[1][6])))
+                        elif op[0] == 'user_columns':
+                            conn.execute("DELETE FROM user_columns")
+                            conn.executemany("INSERT INTO user_columns VALUES (?, ?)", op[1].items())
+                            conn.execute("DELETE FROM users")
+                        else:
+                            conn.execute("INSERT INTO code_journal (op, code_type, codes) VALUES (?, ?, ?)", (op[1], op[2], "\n".join(op[3])))
+                            journaled += 1
+                if journaled >= self.COMPACT_EVERY:
+                    self._compact(conn)
+                    journaled = 0
+            except sqlite3.Error:
+                logging.exception("DB write batch failed")
+            for w in waiters:
+                w.set()
+        conn.close()
+
+# Delivered codes are only ever tested for membership, so they are kept as 8-byte blake2b digests
+# in sorted arrays bucketed by the digests' top bits: ~8 bytes per code instead of ~90 for a set
+# of strings. A collision (odds ~1e-6 at 10M codes) can only make an import skip a fresh code.
+class DigestSet:
+    BUCKET_BITS = 12
+    SHIFT = 64 - BUCKET_BITS
+    def __init__(self, codes=()):
+        self.buckets = [array('Q') for _ in range(1 << self.BUCKET_BITS)]
+        self.size = 0
+        self.update(codes)
+    def __len__(self): return self.size
+    @staticmethod
+    def digest(code): return int.from_bytes(blake2b(code.encode(), digest_size=8).digest(), 'big')
+    def __contains__(self, code):
+        digest = self.digest(code)
+        bucket = self.buckets[digest >> self.SHIFT]
+        i = bisect_left(bucket, digest)
+        return i < len(bucket) and bucket[i] == digest
+    def add_digest(self, digest):
+        bucket = self.buckets[digest >> self.SHIFT]
+        i = bisect_left(bucket, digest)
+        if i == len(bucket) or bucket[i] != digest:
+            bucket.insert(i, digest)
+            self.size += 1
+    def update(self, codes):
+        digests = array('Q', sorted(set(map(self.digest, codes))))
+        # single inserts for the usual handful of codes, a bucket-wise merge for bulk loads
+        if len(digests) * 8 < self.size:
+            for digest in digests:
+                self.add_digest(digest)
+        else:
+            self._merge(digests)
+    def tobytes(self): return b"".join(bucket.tobytes() for bucket in self.buckets)
+    def frombytes(self, data):
+        digests = array('Q')
+        digests.frombytes(data)
+        self._merge(digests)
+    def _merge(self, digests):
+        # digests are sorted and unique, so they split into buckets by bisection
+        start = 0
+        for n, bucket in enumerate(self.buckets):
+            end = bisect_left(digests, (n + 1) << self.SHIFT, start)
+            if end > start:
+                merged = array('Q', sorted(set(bucket).union(digests[start:end]))) if bucket else digests[start:end]
+                self.size += len(merged) - len(bucket)
+                self.buckets[n] = merged
+            start = end
+
+# FIFO queue per code type, a hash set over available codes and a DigestSet over delivered ones,
+# so dedup, allocation and stock counts are O(1) per code regardless of inventory size
+# Reserved codes leave the queue but stay in `available` until they are delivered or released.
+class CodeInventory:
+    def __init__(self, available=None, delivered=(), reserved=None):
+        self.queues = {code_type: deque() for code_type in CODE_TYPES}
+        self.available = set()
+        self.delivered = delivered if isinstance(delivered, DigestSet) else DigestSet(delivered)
+        self.reserved = dict(reserved or {})
+        self.reserved_counts = dict.fromkeys(CODE_TYPES, 0)
+        held = set()
+        for code_type, codes in self.reserved.values():
+            held.update(codes)
+            self.reserved_counts[code_type] = self.reserved_counts.get(code_type, 0) + len(codes)
+        for code_type, codes in (available or {}).items():
+            q = self.queues.setdefault(code_type, deque())
+            q.extend([c for c in codes if c not in held] if held else codes)
+            self.available.update(codes)
+    def status(self, code):
+        if code in self.available:
+            return 'available'
+        if code in self.delivered:
+            return 'delivered'
+        return None
+    def add(self, code_type, codes):
+        return self.import_batch(code_type, codes)[0]
+    def import_batch(self, code_type, codes):
+        available, delivered = self.available, self.delivered
+        new_codes = []
+        duplicates = already_delivered = 0
+        for code in codes:
+            if code in available:
+                duplicates += 1
+            elif code in delivered:
+                already_delivered += 1
+            else:
+                available.add(code)
+                new_codes.append(code)
+        self.queues.setdefault(code_type, deque()).extend(new_codes)
+        return new_codes, duplicates, already_delivered
+    def take(self, code_type, quantity):
+        q = self.queues.get(code_type)
+        if q is None or len(q) < quantity:
+            return None
+        codes = [q.popleft() for _ in range(quantity)]
+        self.available.difference_update(codes)
+        self.delivered.update(codes)
+        return codes
+    def reserve(self, order_id, code_type, quantity):
+        q = self.queues.get(code_type)
+        if q is None or quantity < 1 or len(q) < quantity:
+            return None
+        codes = [q.popleft() for _ in range(quantity)]
+        self.reserved[order_id] = (code_type, codes)
+        self.reserved_counts[code_type] = self.reserved_counts.get(code_type, 0) + quantity
+        return codes
+    def release(self, order_id):
+        held = self.reserved.pop(order_id, None)
+        if not held:
+            return None
+        code_type, codes = held
+        # released codes go back to the front so they are sold first
+        self.queues.setdefault(code_type, deque()).extendleft(reversed(codes))
+        self.reserved_counts[code_type] -= len(codes)
+        return codes
+    def commit(self, order_id):
+        held = self.reserved.pop(order_id, None)
+        if not held:
+            return None
+        code_type, codes = held
+        self.reserved_counts[code_type] -= len(codes)
+        self.available.difference_update(codes)
+        self.delivered.update(codes)
+        return codes
+    def count(self, code_type=None):
+        if code_type:
+            q = self.queues.get(code_type)
+            return len(q) if q is not None else 0
+        return {k: len(v) for k, v in self.queues.items()}
+    def reserved_count(self, code_type=None):
+        if code_type:
+            return self.reserved_counts.get(code_type, 0)
+        return dict(self.reserved_counts)
+
+# Columnar user registry: parallel arrays with one row per user plus a user_id -> row dict,
+# about 40 bytes of columns per user. Segments are map/compress passes over whole columns,
+# so they run in C even with millions of rows. Per code type: purchase counts and last purchase time.
+class UserRegistry:
+    COLUMNS = (('ids', 'q'), ('first_seen', 'q'), ('last_seen', 'q'), ('purchases', 'q'), ('spend', 'q'), ('blocked', 'B'))
+    def __init__(self, columns=None, rows=()):
+        columns = columns or {}
+        for name, typecode in self.COLUMNS:
+            column = array(typecode)
+            column.frombytes(columns.get(name, b''))
+            setattr(self, name, column)
+        self.rows = dict(zip(self.ids, range(len(self.ids))))
+        self.bought = {}
+        for name, data in columns.items():
+            if name.startswith('bought:'):
+                counts, lasts = self._bought(name.split(':', 1)[1])
+                half = len(data) // 2
+                counts[:] = array('q', data[:half])
+                lasts[:] = array('q', data[half:])
+        for user_id, first_seen, last_seen, purchases, spend, blocked, bought in rows:
+            row = self.rows.get(user_id)
+            if row is None:
+                row = self._append(user_id, first_seen)
+            self.first_seen[row] = first_seen
+            self.last_seen[row] = last_seen
+            self.purchases[row] = purchases
+            self.spend[row] = spend
+            self.blocked[row] = blocked
+            for code_type in {*self.bought, *bought}:
+                counts, lasts = self._bought(code_type)
+                counts[row], lasts[row] = bought.get(code_type, (0, 0))
+    def __len__(self): return len(self.ids)
+    def _append(self, user_id, now):
+        row = self.rows[user_id] = len(self.ids)
+        self.ids.append(user_id)
+        self.first_seen.append(now)
+        self.last_seen.append(now)
+        self.purchases.append(0)
+        self.spend.append(0)
+        self.blocked.append(0)
+        for counts, lasts in self.bought.values():
+            counts.append(0)
+            lasts.append(0)
+        return row
+    def _bought(self, code_type):
+        if code_type not in self.bought:
+            self.bought[code_type] = (array('q', [0]) * len(self.ids), array('q', [0]) * len(self.ids))
+        return self.bought[code_type]
+    def touch(self, user_id, now):
+        # True when the row changed enough to be worth persisting
+        row = self.rows.get(user_id)
+        if row is None:
+            self._append(user_id, now)
+            return True
+        changed = self.blocked[row] or now - self.last_seen[row] >= USER_SEEN_RESOLUTION
+        self.last_seen[row] = now
+        self.blocked[row] = 0
+        return bool(changed)
+    def record_purchase(self, user_id, code_type, amount, now):
+        row = self.rows.get(user_id)
+        if row is None:
+            row = self._append(user_id, now)
+        self.purchases[row] += 1
+        self.spend[row] += amount
+        counts, lasts = self._bought(code_type)
+        counts[row] += 1
+        lasts[row] = max(lasts[row], now)
+    def set_blocked(self, user_id, blocked):
+        row = self.rows.get(user_id)
+        if row is None or self.blocked[row] == blocked:
+            return False
+        self.blocked[row] = blocked
+        return True
+    def row(self, user_id):
+        r = self.rows[user_id]
+        bought = {k: (counts[r], lasts[r]) for k, (counts, lasts) in self.bought.items() if counts[r]}
+        return (user_id, self.first_seen[r], self.last_seen[r], self.purchases[r], self.spend[r], self.blocked[r], bought)
+    def info(self, user_id):
+        if user_id not in self.rows:
+            return None
+        _, first_seen, last_seen, purchases, spend, blocked, bought = self.row(user_id)
+        preferred = max(bought, key=lambda k: bought[k], default=None)
+        return {'first_seen': first_seen, 'last_seen': last_seen, 'purchases': purchases, 'spend': spend,
+                'blocked': bool(blocked), 'preferred_code_type': preferred}
+    def segment(self, name, code_type=None, days=30, now=None):
+        # blocked users are never part of a segment
+        cutoff = int(now or time.time()) - days * 24 * 60 * 60
+        if name == 'all':
+            return list(compress(self.ids, map(not_, self.blocked)))
+        if name == 'buyers':
+            keep = self.purchases
+        elif name == 'never':
+            keep = map(not_, self.purchases)
+        elif name == 'active':
+            keep = map(cutoff.__le__, self.last_seen)
+        elif name == 'inactive':
+            keep = map(cutoff.__gt__, self.last_seen)
+        elif name == 'bought':
+            if code_type not in self.bought:
+                return []
+            keep = map(cutoff.__le__, self.bought[code_type][1])
+        else:
+            raise ValueError(f"Unknown segment {name!r}")
+        return list(compress(self.ids, map(and_, keep, map(not_, self.blocked))))
+    def columns(self):
+        columns = {name: getattr(self, name).tobytes() for name, _ in self.COLUMNS}
+        for code_type, (counts, lasts) in self.bought.items():
+            columns[f'bought:{code_type}'] = counts.tobytes() + lasts.tobytes()
+        return columns
+    def stats(self):
+        return {'users': len(self.ids), 'blocked': sum(self.blocked), 'buyers': sum(map(bool, self.purchases))}
+
+# Sales per hour and per day, split by code type and pricing tier: [invoices, paid, revenue,
+# verify_seconds]. Invoices count when created, payments (with revenue and verify latency) when
+# verified. Reports read one daily bucket per day in range, or 24 hourly ones for a single day.
+class SalesRollups:
+    # bucket keys are prefixes of ISO timestamps: YYYY-MM-DDTHH and YYYY-MM-DD
+    LEVELS = (('hour', 13), ('day', 10))
+    def __init__(self, rows=()):
+        self.buckets = {level: {} for level, _ in self.LEVELS}
+        for level, bucket, code_type, tier, *counts in rows:
+            self.buckets[level].setdefault(bucket, {})[code_type, tier] = counts
+    def add(self, when, code_type, tier, *counts):
+        # `when` is an ISO timestamp; returns the changed rows, ready to persist
+        changed = []
+        for level, length in self.LEVELS:
+            bucket = when[:length]
+            totals = self.buckets[level].setdefault(bucket, {}).setdefault((code_type, tier), [0, 0, 0, 0])
+            for i, n in enumerate(counts):
+                totals[i] += n
+            changed.append((level, bucket, code_type, tier, *totals))
+        return changed
+    def rows(self):
+        for level, buckets in self.buckets.items():
+            for bucket, cells in buckets.items():
+                for (code_type, tier), totals in cells.items():
+                    yield (level, bucket, code_type, tier, *totals)
+    def report(self, start, end):
+        if start == end:
+            level, keys = 'hour', [f"{start.isoformat()}T{h:02d}" for h in range(24)]
+        else:
+            level, keys = 'day', [(start + timedelta(days=n)).isoformat() for n in range((end - start).days + 1)]
+        report = {'level': level, 'rows': [], 'total': [0, 0, 0, 0], 'by_type': {}, 'by_tier': {}}
+        for key in keys:
+            cells = self.buckets[level].get(key)
+            if not cells:
+                continue
+            row = [0, 0, 0, 0]
+            for (code_type, tier), counts in cells.items():
+                for totals in (row, report['total'], report['by_type'].setdefault(code_type, [0, 0, 0, 0]),
+                               report['by_tier'].setdefault(tier, [0, 0, 0, 0])):
+                    for i, n in enumerate(counts):
+                        totals[i] += n
+            report['rows'].append((key, row))
+        return report
+
+# Order lifecycle. Re-applying a transition is a no-op and anything not listed is refused,
+# so repeated or racing callbacks can never deliver twice or reject a paid order.
+ORDER_TRANSITIONS = {
+    'pending': {'reserved', 'paid', 'rejected', 'cancelled'},
+    'reserved': {'pending', 'paid', 'rejected', 'cancelled'},
+    'paid': {'delivered'},
+    'delivered': set(),
+    'rejected': set(),
+    'cancelled': set(),
+}
+OPEN_STATUSES = ('pending', 'reserved')
+ARCHIVE_STATUSES = ('delivered', 'rejected', 'cancelled')
+
+# A slotted object per order is under a third of the size of the equivalent dict.
+# Persisted as JSON without its unset fields, the same records the orders table always held.
+@dataclass(slots=True)
+class Order:
+    user_id: int
+    username: str
+    code_type: str
+    quantity: int
+    amount: int
+    status: str
+    created_at: str
+    payment_verified: bool = False
+    delivered: bool = False
+    codes: list = None
+    reserved_until: str = None
+    verified_at: str = None
+    utr: str = None
+    # pricing tier at invoice time, so rollups don't depend on the catalog loaded later
+    tier: int = None
+    def to_dict(self): return {name: value for name in ORDER_FIELDS if (value := getattr(self, name)) is not None}
+
+ORDER_FIELDS = tuple(f.name for f in fields(Order))
+
+class SimpleDB:
+    def __init__(self, backend=None):
+        self.backend = backend or MemoryBackend()
+        orders, available, delivered = self.backend.load()
+        self.orders = {oid: Order(**o) for oid, o in orders.items()}
+        del orders
+        reserved = {oid: (o.code_type, o.codes) for oid, o in self.orders.items() if o.status == 'reserved'}
+        self.inventory = CodeInventory(available, delivered, reserved)
+        # TTL is constant, so creation order is expiry order
+        self.expiry = deque(sorted(
+            (datetime.fromisoformat(self.orders[oid].reserved_until).timestamp(), oid) for oid in reserved
+        ))
+        # secondary indexes (insertion-ordered dicts used as ordered sets) and running counters;
+        # open_orders holds everything still awaiting verification (pending or reserved)
+        self.by_status, self.by_user, self.by_code_type, self.open_orders, self.by_utr = {}, {}, {}, {}, {}
+        # archived orders still count towards the totals
+        total, paid, revenue = self.backend.archive_stats()
+        self.stats = {'total': total, 'paid': paid, 'pending': 0, 'revenue': revenue}
+        for order_id, order in self.orders.items():
+            self._index(order_id, order)
+        self.users = UserRegistry(*self.backend.load_users())
+        if not len(self.users) and self.orders:
+            self._backfill_users()
+        rollups = self.backend.load_rollups()
+        self.rollups = SalesRollups(rollups)
+        if not rollups and self.stats['total']:
+            self._backfill_rollups()
+        self.catalog_version = 0
+    def _index(self, order_id, order):
+        self.by_status.setdefault(order.status, {})[order_id] = None
+        self.by_user.setdefault(order.user_id, {})[order_id] = None
+        self.by_code_type.setdefault(order.code_type, {})[order_id] = None
+        if order.utr:
+            self.by_utr.setdefault(order.utr, order_id)
+        self.stats['total'] += 1
+        if order.status in OPEN_STATUSES:
+            self.open_orders[order_id] = None
+            self.stats['pending'] += 1
+        if order.payment_verified:
+            self.stats['paid'] += 1
+            self.stats['revenue'] += order.amount
+    def _unindex(self, order_id, order):
+        for index, key in ((self.by_status, order.status), (self.by_user, order.user_id), (self.by_code_type, order.code_type)):
+            ids = index[key]
+            del ids[order_id]
+            if not ids:
+                del index[key]
+        if order.utr and self.by_utr.get(order.utr) == order_id:
+            del self.by_utr[order.utr]
+    def _backfill_users(self):
+        # first start with a registry: rebuild it from order history
+        for order in self.orders.values():
+            self.users.touch(order.user_id, int(datetime.fromisoformat(order.created_at).timestamp()))
+            if order.payment_verified:
+                verified_at = datetime.fromisoformat(order.verified_at or order.created_at)
+                self.users.record_purchase(order.user_id, order.code_type, order.amount, int(verified_at.timestamp()))
+        for user_id in self.users.rows:
+            self.backend.save_user(self.users.row(user_id))
+    def _backfill_rollups(self):
+        # first start with rollups: rebuild them from order history, archive included
+        for order in self.orders.values():
+            self._roll_up(order, True, order.payment_verified)
+        for archived in self.backend.iter_archived():
+            order = Order(**archived)
+            self._roll_up(order, True, order.payment_verified)
+        self.backend.save_rollups(list(self.rollups.rows()))
+    def _roll_up(self, order, invoice, payment):
+        tier = order.tier or pricing_tier(order.code_type, order.quantity)
+        changed = []
+        if invoice:
+            changed += self.rollups.add(order.created_at, order.code_type, tier, 1, 0, 0, 0)
+        if payment:
+            verified_at = order.verified_at or order.created_at
+            latency = int((datetime.fromisoformat(verified_at) - datetime.fromisoformat(order.created_at)).total_seconds())
+            changed += self.rollups.add(verified_at, order.code_type, tier, 0, 1, order.amount, latency)
+        return changed
+    def _set_status(self, order_id, order, status):
+        old = order.status
+        if status not in ORDER_TRANSITIONS.get(old, ()):
+            return False
+        self.by_status.get(old, {}).pop(order_id, None)
+        self.by_status.setdefault(status, {})[order_id] = None
+        if status not in OPEN_STATUSES and old in OPEN_STATUSES:
+            self.open_orders.pop(order_id, None)
+            self.stats['pending'] -= 1
+        order.status = status
+        return True
+    def create_order(self, user_id, username, code_type, quantity, amount, tier=None):
+        if quantity < 1:
+            return None
+        # one hold per user: an earlier invoice's codes go back to stock, and that order stays
+        # open as 'pending' (it can still be verified if the user already paid it)
+        for held in [oid for oid in self.by_user.get(user_id, ()) if self.orders[oid].status == 'reserved']:
+            self.release_order(held, 'pending')
+        order_id = base = f"ORD{datetime.now().strftime('%Y%m%d%H%M%S')}{user_id % 10000}"
+        n = 1
+        while order_id in self.orders:
+            n += 1
+            order_id = f"{base}-{n}"
+        codes = self.inventory.reserve(order_id, code_type, quantity)
+        if codes is None:
+            return None
+        now = datetime.now()
+        expires_at = now + timedelta(seconds=RESERVATION_TTL)
+        self.orders[order_id] = Order(user_id, username, code_type, quantity, amount, 'reserved', now.isoformat(), codes=codes, reserved_until=expires_at.isoformat(), tier=tier or pricing_tier(code_type, quantity))
+        self.expiry.append((expires_at.timestamp(), order_id))
+        self._index(order_id, self.orders[order_id])
+        self.backend.save_order(order_id, self.orders[order_id])
+        self.backend.save_rollups(self._roll_up(self.orders[order_id], True, False))
+        return order_id
+    def verify_payment(self, order_id):
+        order = self.orders.get(order_id)
+        if not order or not self._set_status(order_id, order, 'paid'):
+            return False
+        now = datetime.now()
+        order.payment_verified = True
+        order.verified_at = now.isoformat()
+        self.stats['paid'] += 1
+        self.stats['revenue'] += order.amount
+        self.backend.save_order(order_id, order)
+        self.users.record_purchase(order.user_id, order.code_type, order.amount, int(now.timestamp()))
+        self.backend.save_user(self.users.row(order.user_id))
+        self.backend.save_rollups(self._roll_up(order, False, True))
+        return True
+    def mark_delivered(self, order_id):
+        order = self.orders.get(order_id)
+        if not order or not self._set_status(order_id, order, 'delivered'):
+            return False
+        order.delivered = True
+        self.backend.save_order(order_id, order)
+        return True
+    def claim_codes(self, order_id):
+        # pending/reserved -> paid in one step: commits the hold (or takes fresh stock
+        # if it expired) and records the payment; None if the order can't be paid
+        order = self.orders.get(order_id)
+        if not order or 'paid' not in ORDER_TRANSITIONS.get(order.status, ()):
+            return None
+        codes = self.inventory.commit(order_id)
+        if codes is None:
+            codes = self.inventory.take(order.code_type, order.quantity)
+            if codes is None:
+                return None
+        order.codes = codes
+        order.reserved_until = None
+        self.backend.mark_delivered(codes, order.code_type)
+        self.verify_payment(order_id)
+        return codes
+    def release_order(self, order_id, status):
+        order = self.orders.get(order_id)
+        if not order or status not in ORDER_TRANSITIONS.get(order.status, ()):
+            return False
+        self.inventory.release(order_id)
+        self._set_status(order_id, order, status)
+        order.codes = order.reserved_until = None
+        self.backend.save_order(order_id, order)
+        return True
+    def release_expired(self, limit, now=None):
+        # expired holds go back to stock; the order stays open as 'pending' and can still be verified
+        now = now or time.time()
+        released = []
+        while self.expiry and len(released) < limit and self.expiry[0][0] <= now:
+            _, order_id = self.expiry.popleft()
+            order = self.orders.get(order_id)
+            if order and order.status == 'reserved' and self.release_order(order_id, 'pending'):
+                released.append(order_id)
+        return released
+    def archive_orders(self, limit, now=None):
+        # orders is in creation order, so everything old enough is a prefix of it; the batch is only
+        # queued here and stays in memory until drop_archived, once the writer has flushed it, so a
+        # lookup can never miss it in between
+        cutoff = datetime.fromtimestamp((now or time.time()) - ORDER_ARCHIVE_AGE).isoformat()
+        batch = []
+        for order_id, order in self.orders.items():
+            if order.created_at > cutoff or len(batch) >= limit:
+                break
+            if order.status in ARCHIVE_STATUSES:
+                batch.append((order_id, order))
+        if batch:
+            self.backend.archive_orders([(order_id, order.to_dict()) for order_id, order in batch])
+        return [order_id for order_id, _ in batch]
+    def drop_archived(self, order_ids):
+        for order_id in order_ids:
+            order = self.orders.pop(order_id, None)
+            if order:
+                self._unindex(order_id, order)
+    def get_available_codes(self, code_type, quantity):
+        codes = self.inventory.take(code_type, quantity)
+        if codes:
+            self.backend.mark_delivered(codes, code_type)
+        return codes
+    def add_codes_from_channel(self, code_type, codes_list):
+        return self.import_codes(code_type, codes_list)[0]
+    def import_codes(self, code_type, codes_list):
+        new_codes, duplicates, already_delivered = self.inventory.import_batch(code_type, codes_list)
+        self.backend.add_codes(code_type, new_codes)
+        return len(new_codes), duplicates, already_delivered
+    def get_stock_count(self, code_type=None): return self.inventory.count(code_type)
+    def get_reserved_count(self, code_type=None): return self.inventory.reserved_count(code_type)
+    def get_order(self, order_id):
+        order = self.orders.get(order_id)
+        if order is None:
+            archived = self.backend.load_archived(order_id)
+            order = archived and Order(**archived)
+        return order
+    def get_orders_by_status(self, status): return {oid: self.orders[oid] for oid in self.by_status.get(status, ())}
+    def get_pending_orders(self): return {oid: self.orders[oid] for oid in self.open_orders}
+    def get_pending_page(self, offset, limit, code_type=None, created_before=None):
+        # open_orders is in creation order, so an age cutoff is a prefix of it
+        rows = ((oid, self.orders[oid]) for oid in self.open_orders)
+        if created_before:
+            rows = takewhile(lambda r: r[1].created_at <= created_before, rows)
+        if code_type:
+            rows = (r for r in rows if r[1].code_type == code_type)
+        page = list(islice(rows, offset, offset + limit + 1))
+        return page[:limit], len(page) > limit
+    def get_user_orders(self, user_id):
+        orders = {oid: Order(**o) for oid, o in self.backend.load_archived_user(user_id).items()}
+        orders.update((oid, self.orders[oid]) for oid in self.by_user.get(user_id, ()))
+        return orders
+    def get_code_type_orders(self, code_type): return {oid: self.orders[oid] for oid in self.by_code_type.get(code_type, ())}
+    def get_stats(self): return dict(self.stats)
+    def get_report(self, start, end): return self.rollups.report(start, end)
+    def get_order_ids_between(self, start, end):
+        # the orders in memory created from start to end (dates, inclusive), as a snapshot of ids
+        low, high = start.isoformat(), (end + timedelta(days=1)).isoformat()
+        return [oid for oid, o in self.orders.items() if low <= o.created_at < high]
+    def get_archived_between(self, start, end, after='', limit=EXPORT_PAGE_SIZE):
+        # archived orders from the same range, paged by the last order id seen
+        low, high = (f"ORD{d.strftime('%Y%m%d')}" for d in (start, end + timedelta(days=1)))
+        return [(oid, Order(**o)) for oid, o in self.backend.load_archived_range(low, high, after, limit)]
+    def get_orders(self, order_ids): return [(oid, order) for oid in order_ids if (order := self.get_order(oid))]
+    def set_order_utr(self, order_id, utr, user_id=None):
+        # returns the order that owns the UTR afterwards: order_id, or an earlier order it was
+        # already submitted for; None if the order isn't awaiting payment or isn't user_id's
+        order = self.orders.get(order_id)
+        if not order or order.status not in OPEN_STATUSES or user_id is not None and order.user_id != user_id:
+            return None
+        owner = self.by_utr.get(utr) or self.backend.find_archived_utr(utr) or order_id
+        if owner != order_id and self.get_order(owner).status in ('rejected', 'cancelled'):
+            # a UTR from a dead order can be reused, e.g. after it was cancelled by mistake
+            owner = order_id
+        if owner == order_id:
+            self.by_utr[utr] = order_id
+            if order.utr != utr:
+                if order.utr and self.by_utr.get(order.utr) == order_id:
+                    del self.by_utr[order.utr]
+                order.utr = utr
+                self.backend.save_order(order_id, order)
+        return owner
+    def get_order_by_utr(self, utr): return self.by_utr.get(utr)
+    def match_statement(self, entries):
+        # entries: {utr: (amount in paise, statement time)}. Open orders whose UTR appears with the
+        # exact amount are returned for verification; everything else is sorted for review
+        result = {'matched': [], 'mismatched': [], 'closed': 0, 'unknown': 0, 'missing': 0}
+        for utr, (paise, when) in entries.items():
+            order_id = self.by_utr.get(utr)
+            if order_id is None:
+                result['closed' if self.backend.find_archived_utr(utr) else 'unknown'] += 1
+                continue
+            order = self.orders[order_id]
+            if order.status not in OPEN_STATUSES:
+                result['closed'] += 1
+            elif paise == order.amount * 100:
+                result['matched'].append(order_id)
+            else:
+                result['mismatched'].append((order_id, utr, order.amount, paise, when))
+        result['missing'] = sum(
+            1 for order_id in self.open_orders if self.orders[order_id].utr and self.orders[order_id].utr not in entries
+        )
+        return result
+    def touch_user(self, user_id):
+        if self.users.touch(user_id, int(time.time())):
+            self.backend.save_user(self.users.row(user_id))
+    def set_user_blocked(self, user_id, blocked=True):
+        if self.users.set_blocked(user_id, int(blocked)):
+            self.backend.save_user(self.users.row(user_id))
+    def get_user(self, user_id): return self.users.info(user_id)
+    def get_segment(self, name, code_type=None, days=30): return self.users.segment(name, code_type, days)
+    def get_user_stats(self): return self.users.stats()
+    def register_code_types(self, code_types):
+        for code_type in code_types:
+            self.inventory.queues.setdefault(code_type, deque())
+            self.inventory.reserved_counts.setdefault(code_type, 0)
+    def bump_catalog_version(self):
+        self.catalog_version += 1
+        return self.catalog_version
+    def get_catalog_version(self): return self.catalog_version
+    def close(self):
+        self.backend.save_user_columns(self.users.columns())
+        self.backend.close()
+
+# Multi-worker mode: the master serves its SimpleDB to the workers over a local
+# multiprocessing manager. Every SimpleDB method is a single call under one lock, so an
+# allocation or status transition is atomic across processes; results come back as copies.
+class LockedDB:
+    def __init__(self, db):
+        self.db = db
+        self.lock = threading.Lock()
+    def __getattr__(self, name):
+        attr = getattr(self.db, name)
+        if not callable(attr):
+            return attr
+        def call(*args, **kwargs):
+            with self.lock:
+                return attr(*args, **kwargs)
+        return call
+
+class SharedStore(BaseManager):
+    pass
+
+SHARED_DB_METHODS = tuple(name for name in vars(SimpleDB) if not name.startswith('_') and name != 'close')
+
+def serve_shared_store(shared_db):
+    SharedStore.register('db', callable=lambda: shared_db, exposed=SHARED_DB_METHODS)
+    authkey = os.urandom(16)
+    server = SharedStore(address=("127.0.0.1", 0), authkey=authkey).get_server()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.address
+    return f"{host}:{port}:{authkey.hex()}"
+
+def connect_shared_store(address):
+    SharedStore.register('db', exposed=SHARED_DB_METHODS)
+    host, port, authkey = address.split(":")
+    store = SharedStore(address=(host, int(port)), authkey=bytes.fromhex(authkey))
+    store.connect()
+    return store
+
+if BOT_SHARED_STORE:
+    shared_store = connect_shared_store(BOT_SHARED_STORE)
+    db = shared_store.db()
+else:
+    db = SimpleDB(SQLiteBackend(DB_PATH) if DB_PATH else None)
+
+# A fixed pool of asyncio locks keyed by hash(order_id): callbacks for the same order
+# serialize, different orders almost always land on different stripes and run in parallel
+class LockStripes:
+    def __init__(self, stripes=ORDER_LOCK_STRIPES):
+        self.locks = [asyncio.Lock() for _ in range(stripes)]
+    def lock(self, key): return self.locks[hash(key) % len(self.locks)]
+
+order_locks = LockStripes()
+
+# FSM storage: an LRU cache in front of SQLite. Writes are coalesced per key and flushed
+# off the event loop every FSM_FLUSH_INTERVAL; entries idle for FSM_TTL read as empty and are swept.
+class SQLiteStorage(BaseStorage):
+    EMPTY = (None, {}, 0.0)
+    def __init__(self, path, cache_size=FSM_CACHE_SIZE, ttl=FSM_TTL):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS fsm (key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS fsm_updated ON fsm (updated_at)")
+        self.conn.commit()
+        self.lock = threading.Lock()
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self.cache = OrderedDict()
+        self.dirty = {}
+        self.flushing = {}
+        self.flusher = None
+    @staticmethod
+    def _key(key): return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+    def _remember(self, k, entry):
+        self.cache[k] = entry
+        self.cache.move_to_end(k)
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+    def _get(self, k):
+        entry = self.cache.get(k)
+        if entry is not None:
+            self.cache.move_to_end(k)
+        else:
+            entry = self.dirty.get(k) or self.flushing.get(k)
+            if entry is None:
+                with self.lock:
+                    row = self.conn.execute("SELECT state, data, updated_at FROM fsm WHERE key = ?", (k,)).fetchone()
+                entry = (row[0], json.loads(row[1]), row[2]) if row else self.EMPTY
+            self._remember(k, entry)
+        if entry[2] and time.time() - entry[2] > self.ttl:
+            return self.EMPTY
+        return entry
+    def _put(self, k, state, data):
+        entry = (state, data, time.time())
+        self._remember(k, entry)
+        self.dirty[k] = entry
+        if self.flusher is None or self.flusher.done():
+            self.flusher = asyncio.create_task(self._flush_later())
+    async def set_state(self, key, state=None):
+        k = self._key(key)
+        self._put(k, state.state if isinstance(state, State) else state, self._get(k)[1])
+    async def get_state(self, key): return self._get(self._key(key))[0]
+    async def set_data(self, key, data):
+        k = self._key(key)
+        self._put(k, self._get(k)[0], dict(data))
+    async def get_data(self, key): return dict(self._get(self._key(key))[1])
+    async def _flush_later(self):
+        await asyncio.sleep(FSM_FLUSH_INTERVAL)
+        await self.flush()
+    async def flush(self):
+        if not self.dirty:
+            return
+        self.flushing, self.dirty = self.dirty, {}
+        try:
+            await asyncio.to_thread(self._write, self.flushing)
+        finally:
+            self.flushing = {}
+    def _write(self, batch):
+        rows = [(k, st, json.dumps(data), ts) for k, (st, data, ts) in batch.items() if st is not None or data]
+        gone = [(k,) for k, (st, data, ts) in batch.items() if st is None and not data]
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO fsm (key, state, data, updated_at) VALUES (?, ?, ?, ?) ON CONFLICT(key) DO UPDATE SET "
+                "state = excluded.state, data = excluded.data, updated_at = excluded.updated_at", rows
+            )
+            self.conn.executemany("DELETE FROM fsm WHERE key = ?", gone)
+            self.conn.execute("DELETE FROM fsm WHERE updated_at < ?", (time.time() - self.ttl,))
+    async def close(self):
+        if self.flusher and not self.flusher.done():
+            self.flusher.cancel()
+        await self.flush()
+        self.conn.close()
+
+class OrderStates(StatesGroup):
+    selecting_code_type = State()
+    waiting_for_terms = State()
+    selecting_quantity = State()
+    waiting_for_custom_quantity = State()
+    awaiting_payment = State()
+    waiting_for_proof = State()
+    verifying_payment = State()
+    broadcast_message = State()
+    waiting_for_qr = State()
+
+# Static keyboards are built once per catalog load and shared by every update
+class KeyboardCache:
+    def __init__(self):
+        self.terms = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="✅ Accept", callback_data="terms_accept"),
+             InlineKeyboardButton(text="❌ Decline", callback_data="terms_decline")]
+        ])
+        self.rebuild()
+    def rebuild(self):
+        self.code_types = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text=item["display"], callback_data=f"code_{code_type}")]
+            for code_type, item in CODE_TYPES.items()
+        ])
+        self.quantities = {code_type: self._quantity_keyboard(item["pricing"]) for code_type, item in CODE_TYPES.items()}
+        stock_text.cache_clear()
+        stock_text_with_reserved.cache_clear()
+    @staticmethod
+    def _quantity_keyboard(pricing):
+        buttons = [
+            InlineKeyboardButton(text=f"{qty} Code{'s' if qty > 1 else ''} - Rs.{price}", callback_data=f"qty_{qty}")
+            for qty, price in pricing.items()
+        ]
+        buttons.append(InlineKeyboardButton(text="📝 Custom", callback_data="qty_custom"))
+        return InlineKeyboardMarkup(inline_keyboard=[
+            *(buttons[i:i + 2] for i in range(0, len(buttons), 2)),
+            [InlineKeyboardButton(text="📦 Check Stock", callback_data="check_stock")],
+            [InlineKeyboardButton(text="🔙 Cancel", callback_data="cancel")]
+        ])
+
+@lru_cache(maxsize=256)
+def stock_text(counts):
+    return "\n".join(f"{display_name(k)}: {v}" for k, v in zip(CODE_TYPES, counts))
+
+@lru_cache(maxsize=256)
+def stock_text_with_reserved(counts, reserved):
+    return "\n".join(
+        f"{display_name(k)}: {v} available | {r} reserved" for k, v, r in zip(CODE_TYPES, counts, reserved)
+    )
+
+def stock_counts():
+    stocks = db.get_stock_count()
+    return tuple(stocks.get(k, 0) for k in CODE_TYPES)
+
+keyboards = KeyboardCache()
+catalog_version = 0
+
+def reload_catalog():
+    catalog = load_catalog()
+    CODE_TYPES.clear()
+    CODE_TYPES.update(catalog)
+    db.register_code_types(list(catalog))
+    keyboards.rebuild()
+
+def get_code_type_keyboard(): return keyboards.code_types
+
+def get_terms_keyboard(): return keyboards.terms
+
+def get_quantity_keyboard(code_type): return keyboards.quantities[code_type]
+
+def get_payment_keyboard(order_id):
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="💸 Pay Here", url=PAY_URL)],
+        [InlineKeyboardButton(text="📤 Send UTR/Screenshot", callback_data=f"sendproof_{order_id}")],
+        [InlineKeyboardButton(text="❌ Cancel Order", callback_data="cancel_order")]
+    ])
+
+def get_admin_verify_keyboard(order_id):
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="✅ Confirm Payment", callback_data=f"verify_{order_id}"),
+         InlineKeyboardButton(text="❌ Reject", callback_data=f"reject_{order_id}")]
+    ])
+
+def get_broadcast_keyboard(status):
+    if status == 'running':
+        toggle = InlineKeyboardButton(text="⏸ Pause", callback_data="bc_pause")
+    else:
+        toggle = InlineKeyboardButton(text="▶️ Resume", callback_data="bc_resume")
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [toggle, InlineKeyboardButton(text="⏹ Cancel", callback_data="bc_cancel")]
+    ])
+
+def upi_intent_url(amount, order_id):
+    params = {'pa': UPI_ID}
+    if UPI_PAYEE_NAME:
+        params['pn'] = UPI_PAYEE_NAME
+    params.update(am=f"{amount:.2f}", cu="INR")
+    if UPI_QR_NOTE:
+        params['tn'] = UPI_QR_NOTE.format(order_id=order_id)
+    return "upi://pay?" + urlencode(params, quote_via=quote, safe="@")
+
+@lru_cache(maxsize=QR_CACHE_SIZE)
+def render_qr_png(url): return qr.to_png(qr.encode(url))
+
+# Telegram file_ids of QRs already uploaded, keyed by UPI URL (or the static file), so a
+# repeat QR is re-sent by reference instead of re-rendered and re-uploaded
+class PaymentQR:
+    def __init__(self, size=QR_CACHE_SIZE):
+        self.size = size
+        self.file_ids = OrderedDict()
+    def remember(self, key, file_id):
+        self.file_ids[key] = file_id
+        self.file_ids.move_to_end(key)
+        if len(self.file_ids) > self.size:
+            self.file_ids.popitem(last=False)
+    async def _photo(self, key):
+        file_id = self.file_ids.get(key)
+        if file_id:
+            self.file_ids.move_to_end(key)
+            return file_id
+        if key == UPI_QR_FILE:
+            return FSInputFile(UPI_QR_FILE)
+        # ~20ms of pure-Python encoding; keep it off the event loop
+        return BufferedInputFile(await asyncio.to_thread(render_qr_png, key), filename="upi_qr.png")
+    async def send(self, message, amount, order_id, reply_markup):
+        key = upi_intent_url(amount, order_id) if UPI_ID else UPI_QR_FILE if os.path.exists(UPI_QR_FILE) else None
+        if key:
+            try:
+                sent = await message.answer_photo(
+                    await self._photo(key), reply_markup=reply_markup,
+                    caption=f"💸 Order {order_id}: scan to pay Rs.{amount} in any UPI app, or choose your UPI app below:"
+                )
+                self.remember(key, sent.photo[-1].file_id)
+                return sent
+            except (TelegramBadRequest, OSError, ValueError) as e:
+                # stale file_id or unreadable image: fall back to the plain prompt
+                self.file_ids.pop(key, None)
+                logging.warning("Payment QR for %s failed: %s", order_id, e)
+        return await message.answer("💸 Choose your UPI app below to pay instantly:", reply_markup=reply_markup)
+
+payment_qr = PaymentQR()
+
+class RateLimiter:
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self.next_at = 0.0
+        self.lock = asyncio.Lock()
+    async def wait(self):
+        async with self.lock:
+            while (delay := self.next_at - time.monotonic()) > 0:
+                await asyncio.sleep(delay)
+            self.next_at = time.monotonic() + self.interval
+    def hold(self, seconds):
+        self.next_at = max(self.next_at, time.monotonic() + seconds)
+
+# The recipient list is written once, next to the job file; checkpoints only rewrite the small state
+class BroadcastJob:
+    FIELDS = ('admin_chat_id', 'progress_message_id', 'payload', 'offset', 'success', 'failed', 'blocked', 'status')
+    USERS_FILE = BROADCAST_JOB_FILE + ".users"
+    def __init__(self, admin_chat_id, progress_message_id, payload, users, offset=0, success=0, failed=0, blocked=0, status='running'):
+        self.admin_chat_id = admin_chat_id
+        self.progress_message_id = progress_message_id
+        self.payload = payload
+        self.users = users
+        self.offset = offset
+        self.success = success
+        self.failed = failed
+        self.blocked = blocked
+        self.status = status
+    @property
+    def done(self): return self.success + self.failed + self.blocked
+    def progress_text(self):
+        return (
+            f"📣 Broadcast {self.status.upper()}\n"
+            f"Progress: {self.offset}/{len(self.users)}\n"
+            f"Success: {self.success} | Failed: {self.failed} | Blocked: {self.blocked}"
+        )
+    @staticmethod
+    def _write(path, data):
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+    def save_users(self): self._write(self.USERS_FILE, self.users)
+    def save(self): self._write(BROADCAST_JOB_FILE, {k: getattr(self, k) for k in self.FIELDS})
+    @classmethod
+    def load(cls):
+        try:
+            with open(BROADCAST_JOB_FILE) as f, open(cls.USERS_FILE) as u:
+                return cls(users=json.load(u), **json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+    def discard(self):
+        for path in (BROADCAST_JOB_FILE, self.USERS_FILE):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+class Broadcaster:
+    def __init__(self):
+        self.job = None
+        self.task = None
+        self.limiter = RateLimiter(BROADCAST_RATE)
+    @property
+    def busy(self): return self.job is not None
+    def start(self, bot, job):
+        self.job = job
+        job.status = 'running'
+        job.save()
+        self.task = asyncio.create_task(self._run(bot, job))
+    def pause(self):
+        if self.job and self.job.status == 'running':
+            self.job.status = 'paused'
+    def cancel(self):
+        if self.job:
+            self.job.status = 'cancelled'
+    async def restore(self, bot):
+        job = BroadcastJob.load()
+        if not job or job.status not in ('running', 'paused'):
+            return
+        job.status = 'paused'
+        self.job = job
+        try:
+            msg = await bot.send_message(
+                job.admin_chat_id, "♻️ Broadcast interrupted by restart.\n" + job.progress_text(),
+                reply_markup=get_broadcast_keyboard(job.status)
+            )
+            job.progress_message_id = msg.message_id
+        except TelegramAPIError as e:
+            logging.warning("Could not notify admin of the interrupted broadcast: %s", e)
+        job.save()
+    async def _send(self, bot, user_id, payload):
+        if 'photo' in payload:
+            await bot.send_photo(user_id, payload['photo'], caption=payload.get('caption', ''))
+        else:
+            await bot.send_message(user_id, payload['text'])
+    async def _deliver(self, bot, job, user_id):
+        for _ in range(BROADCAST_RETRIES):
+            await self.limiter.wait()
+            try:
+                await self._send(bot, user_id, job.payload)
+                job.success += 1
+                return
+            except TelegramRetryAfter as e:
+                self.limiter.hold(e.retry_after)
+            except TelegramForbiddenError:
+                # blocked the bot or deactivated; skipped by segments until they interact again
+                db.set_user_blocked(user_id)
+                job.blocked += 1
+                return
+            except Exception as e:
+                logging.warning("Broadcast to %s failed: %s", user_id, e)
+                break
+        job.failed += 1
+    async def _report(self, bot, job):
+        try:
+            await bot.edit_message_text(
+                job.progress_text(), chat_id=job.admin_chat_id, message_id=job.progress_message_id,
+                reply_markup=get_broadcast_keyboard(job.status) if job.status in ('running', 'paused') else None
+            )
+        except TelegramRetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+        except TelegramBadRequest:
+            pass
+        except TelegramAPIError as e:
+            logging.warning("Broadcast progress update failed: %s", e)
+    async def _checkpointer(self, job):
+        # separate from the progress edits, so a slow or failing edit never delays a checkpoint
+        while True:
+            await asyncio.sleep(BROADCAST_REPORT_INTERVAL)
+            try:
+                job.save()
+            except OSError as e:
+                logging.warning("Broadcast checkpoint failed: %s", e)
+    async def _reporter(self, bot, job):
+        last = None
+        while True:
+            await asyncio.sleep(BROADCAST_REPORT_INTERVAL)
+            if (job.done, job.status) != last:
+                last = (job.done, job.status)
+                await self._report(bot, job)
+    async def _run(self, bot, job):
+        in_flight = set()
+        cursor = job.offset
+        async def worker():
+            nonlocal cursor
+            while job.status == 'running' and cursor < len(job.users):
+                i = cursor
+                cursor += 1
+                in_flight.add(i)
+                try:
+                    await self._deliver(bot, job, job.users[i])
+                finally:
+                    in_flight.discard(i)
+                    job.offset = min(in_flight) if in_flight else cursor
+        reporter = asyncio.create_task(self._reporter(bot, job))
+        checkpointer = asyncio.create_task(self._checkpointer(job))
+        try:
+            await asyncio.gather(*(worker() for _ in range(BROADCAST_CONCURRENCY)))
+        finally:
+            reporter.cancel()
+            checkpointer.cancel()
+        if job.status == 'running':
+            job.status = 'done'
+        if job.status == 'paused':
+            job.save()
+        else:
+            job.discard()
+            self.job = None
+        await self._report(bot, job)
+
+broadcaster = Broadcaster()
+
+# Admin notifications are queued and fanned out to every admin concurrently,
+# so customer-facing handlers never wait on admin sends
+class AdminNotifier:
+    def __init__(self):
+        self.queue = None
+        self.workers = []
+        self.digest = []
+        self.digest_bot = None
+        self.digest_task = None
+    def _ensure_started(self):
+        if self.queue is None:
+            self.queue = asyncio.Queue()
+            self.workers = [asyncio.create_task(self._worker()) for _ in range(ADMIN_NOTIFY_WORKERS)]
+    def send(self, bot, text, photo=None, reply_markup=None):
+        self._ensure_started()
+        self.queue.put_nowait((bot, text, photo, reply_markup))
+    def new_order(self, bot, text):
+        if not ADMIN_DIGEST_WINDOW:
+            self.send(bot, text)
+            return
+        self.digest.append(text)
+        self.digest_bot = bot
+        if self.digest_task is None or self.digest_task.done():
+            self.digest_task = asyncio.create_task(self._flush_digest(bot))
+    async def _flush_digest(self, bot, delay=ADMIN_DIGEST_WINDOW):
+        await asyncio.sleep(delay)
+        items, self.digest = self.digest, []
+        if not items:
+            return
+        chunk = [f"🧾 {len(items)} new order(s) in the last {ADMIN_DIGEST_WINDOW}s"]
+        size = len(chunk[0])
+        for item in items:
+            if size + len(item) + 2 > 4000:
+                self.send(bot, "\n\n".join(chunk))
+                chunk, size = [], 0
+            chunk.append(item)
+            size += len(item) + 2
+        self.send(bot, "\n\n".join(chunk))
+    async def _deliver(self, bot, admin_id, text, photo, reply_markup):
+        for _ in range(3):
+            try:
+                if photo:
+                    await bot.send_photo(admin_id, photo, caption=text, reply_markup=reply_markup)
+                else:
+                    await bot.send_message(admin_id, text, reply_markup=reply_markup)
+                return
+            except TelegramRetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+            except Exception as e:
+                logging.warning("Admin notification to %s failed: %s", admin_id, e)
+                return
+    async def _worker(self):
+        while True:
+            bot, text, photo, reply_markup = await self.queue.get()
+            try:
+                await asyncio.gather(*(self._deliver(bot, a, text, photo, reply_markup) for a in ADMIN_USER_IDS))
+            finally:
+                self.queue.task_done()
+    async def close(self, timeout=10):
+        if self.digest_task and not self.digest_task.done():
+            self.digest_task.cancel()
+            await self._flush_digest(self.digest_bot, 0)
+        if self.queue is None:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning("Dropped %d queued admin notifications", self.queue.qsize())
+        for w in self.workers:
+            w.cancel()
+
+notifier = AdminNotifier()
+
+def format_age(seconds):
+    if seconds >= 24 * 60 * 60:
+        return f"{seconds // (24 * 60 * 60)}d"
+    if seconds >= 60 * 60:
+        return f"{seconds // (60 * 60)}h"
+    return f"{seconds // 60}m"
+
+def cycle_option(options, current):
+    options = list(options)
+    return options[(options.index(current) + 1) % len(options)] if current in options else options[0]
+
+def render_pending_page(offset, code_type=None, min_age=0):
+    created_before = (datetime.now() - timedelta(seconds=min_age)).isoformat() if min_age else None
+    rows, has_more = db.get_pending_page(offset, PENDING_PAGE_SIZE, code_type, created_before)
+    if not rows and offset:
+        offset = 0
+        rows, has_more = db.get_pending_page(0, PENDING_PAGE_SIZE, code_type, created_before)
+    filters = f"Type: {display_name(code_type) if code_type else 'All'} | Age: {'>' + format_age(min_age) if min_age else 'All'}"
+    lines = [f"⏳ Pending Orders ({db.get_stats()['pending']} total)", filters, f"Page {offset // PENDING_PAGE_SIZE + 1}", ""]
+    buttons = []
+    for oid, o in rows:
+        lines.append(
+            f"Order: {oid}\n"
+            f"User: @{o.username}\n"
+            f"Type: {display_name(o.code_type)}\n"
+            f"Qty: {o.quantity} | Amt: Rs.{o.amount}\n"
+            f"Time: {o.created_at[:16]}\n"
+        )
+        buttons.append([
+            InlineKeyboardButton(text=f"✅ {oid}", callback_data=f"verify_{oid}"),
+            InlineKeyboardButton(text="❌ Reject", callback_data=f"reject_{oid}")
+        ])
+    if not rows:
+        lines.append("✅ No pending orders match.")
+    ct = code_type or 'all'
+    next_type = cycle_option([None, *CODE_TYPES], code_type)
+    next_age = cycle_option(PENDING_AGE_FILTERS, min_age)
+    buttons.append([
+        InlineKeyboardButton(text="🏷 Type", callback_data=f"pending_0_{next_type or 'all'}_{min_age}"),
+        InlineKeyboardButton(text="🕒 Age", callback_data=f"pending_0_{ct}_{next_age}"),
+        InlineKeyboardButton(text="🔄", callback_data=f"pending_{offset}_{ct}_{min_age}")
+    ])
+    nav = []
+    if offset:
+        nav.append(InlineKeyboardButton(text="⬅️ Prev", callback_data=f"pending_{max(offset - PENDING_PAGE_SIZE, 0)}_{ct}_{min_age}"))
+    if has_more:
+        nav.append(InlineKeyboardButton(text="Next ➡️", callback_data=f"pending_{offset + PENDING_PAGE_SIZE}_{ct}_{min_age}"))
+    if nav:
+        buttons.append(nav)
+    return "\n".join(lines), InlineKeyboardMarkup(inline_keyboard=buttons)
+
+# In-process metrics: recording is a dict lookup plus an add (histograms bisect a short
+# bucket tuple); all formatting happens at scrape time
+class Metrics:
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+    def inc(self, name, value=1, **labels):
+        series = self.counters.setdefault(name, {})
+        key = tuple(labels.items())
+        series[key] = series.get(key, 0) + value
+    def histogram(self, name, buckets):
+        self.histograms[name] = (buckets, {})
+    def observe(self, name, value, **labels):
+        buckets, series = self.histograms[name]
+        key = tuple(labels.items())
+        counts = series.get(key)
+        if counts is None:
+            # one slot per bucket, one for +Inf, then the running sum
+            counts = series[key] = [0] * (len(buckets) + 1) + [0.0]
+        counts[bisect_left(buckets, value)] += 1
+        counts[-1] += value
+    def gauge(self, name, fn):
+        self.gauges[name] = fn
+    @staticmethod
+    def _labels(key, extra=()):
+        pairs = [*key, *extra]
+        if not pairs:
+            return ""
+        def esc(v): return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in pairs) + "}"
+    def render(self):
+        out = []
+        for name, series in self.counters.items():
+            out.append(f"# TYPE {name} counter")
+            out.extend(f"{name}{self._labels(k)} {v}" for k, v in series.items())
+        for name, (buckets, series) in self.histograms.items():
+            out.append(f"# TYPE {name} histogram")
+            for key, counts in series.items():
+                running = 0
+                for bound, n in zip((*buckets, "+Inf"), counts):
+                    running += n
+                    out.append(f"{name}_bucket{self._labels(key, [('le', bound)])} {running}")
+                out.append(f"{name}_sum{self._labels(key)} {counts[-1]}")
+                out.append(f"{name}_count{self._labels(key)} {running}")
+        for name, fn in self.gauges.items():
+            out.append(f"# TYPE {name} gauge")
+            out.extend(f"{name}{self._labels(tuple(k))} {v}" for k, v in fn().items())
+        return "\n".join(out) + "\n"
+
+metrics = Metrics()
+metrics.histogram("bot_handler_seconds", LATENCY_BUCKETS)
+metrics.histogram("bot_api_request_seconds", LATENCY_BUCKETS)
+metrics.histogram("bot_order_verify_seconds", VERIFY_BUCKETS)
+metrics.gauge("bot_stock_available", lambda: {(("code_type", k),): v for k, v in db.get_stock_count().items()})
+metrics.gauge("bot_stock_reserved", lambda: {(("code_type", k),): v for k, v in db.get_reserved_count().items()})
+metrics.gauge("bot_orders", lambda: {(("status", k),): v for k, v in db.get_stats().items() if k != 'revenue'})
+metrics.gauge("bot_revenue_rupees", lambda: {(): db.get_stats()['revenue']})
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    # outer middleware: counts every update by type and FSM state, times the whole dispatch
+    # and labels it with the handler name that HandlerNameMiddleware fills in
+    def __init__(self, update_type):
+        self.update_type = update_type
+    async def __call__(self, handler, event, data):
+        ctx = data['metrics_ctx'] = {'handler': 'unhandled'}
+        metrics.inc("bot_updates_total", type=self.update_type, state=data.get('raw_state') or 'none')
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            metrics.inc("bot_handler_errors_total", handler=ctx['handler'])
+            raise
+        finally:
+            metrics.observe("bot_handler_seconds", time.perf_counter() - start, handler=ctx['handler'])
+
+class HandlerNameMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        ctx = data.get('metrics_ctx')
+        if ctx is not None:
+            ctx['handler'] = data['handler'].callback.__name__
+        return await handler(event, data)
+
+class BotAPIMetricsMiddleware(BaseRequestMiddleware):
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        start = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter:
+            metrics.inc("bot_api_flood_waits_total", method=name)
+            raise
+        except Exception:
+            metrics.inc("bot_api_errors_total", method=name)
+            raise
+        finally:
+            metrics.observe("bot_api_request_seconds", time.perf_counter() - start, method=name)
+
+router = Router()
+for observer, update_type in ((router.message, "message"), (router.callback_query, "callback_query")):
+    observer.outer_middleware(UpdateMetricsMiddleware(update_type))
+    observer.middleware(HandlerNameMiddleware())
+
+@router.message(Command("start"))
+async def cmd_start(message: Message, state: FSMContext):
+    db.touch_user(message.from_user.id)
+    await message.answer(
+        "🛍️ Welcome to Discount Codes Store!\n\n"
+        f"📦 Stock:\n{stock_text(stock_counts())}\n"
+        f"🌐 Pay Online: {PAY_URL}\n"
+        "💳 Payment via UPI\n"
+        "⚡ Instant delivery after verification\n"
+        "Use /buy to start.\nSupport: @animeverse23_requesting_bot"
+    )
+
+@router.message(Command("help"))
+async def cmd_help(message: Message, state: FSMContext):
+    if message.from_user.id in ADMIN_USER_IDS:
+        await message.answer(
+            "📖 ADMIN HELP MENU\n"
+            "Admin Commands:\n"
+            "/addcode code_type CODE1[\\nCODE2...]\n"
+            "/addcode code_type as caption of a .txt/.csv file - Bulk import\n"
+            "/stock - Inventory\n"
+            "/pending - View pending orders\n"
+            "/setqr - Update UPI QR code\n"
+            "/reload - Reload catalog.json\n"
+            "/reconcile as caption of a statement .csv - Auto-verify matching UTRs\n"
+            "/report [DAYS|DATE [DATE]] [csv] - Sales report, csv adds the raw orders\n"
+            "/sendall [all|buyers|never|active N|inactive N|bought TYPE N] - Broadcast to a user segment\n"
+            "Customer Commands:\n"
+            "/start - Welcome\n/buy - Buy codes\n/stock - Stock\n/help - Help\n/cancel - Cancel action"
+        )
+    else:
+        await message.answer(
+            "Customer Commands:\n"
+            "/start - Welcome\n/buy - Buy codes\n/stock - Stock\n/help - Help"
+        )
+
+@router.message(Command("buy"))
+async def cmd_buy(message: Message, state: FSMContext):
+    db.touch_user(message.from_user.id)
+    stocks = db.get_stock_count()
+    in_stock = any(qty > 0 for qty in stocks.values())
+    if not in_stock:
+        await message.answer(
+            "❌ Out of Stock\nNo codes available now.\nPlease check later or contact @animeverse23_requesting_bot"
+        )
+        return
+    await message.answer("Select code type:", reply_markup=get_code_type_keyboard())
+    await state.set_state(OrderStates.selecting_code_type)
+
+@router.callback_query(F.data.startswith("code_"))
+async def code_type_selected(callback: CallbackQuery, state: FSMContext):
+    code_type = callback.data.split("_")[1]
+    if code_type not in CODE_TYPES:
+        await callback.answer("❌ This code type is no longer available.", show_alert=True)
+        return
+    await state.update_data(code_type=code_type)
+    await callback.message.edit_text(
+        TERMS_TEXT, reply_markup=get_terms_keyboard()
+    )
+    await state.set_state(OrderStates.waiting_for_terms)
+    await callback.answer()
+
+@router.callback_query(F.data == "terms_accept")
+async def terms_accepted(callback: CallbackQuery, state: FSMContext):
+    db.touch_user(callback.from_user.id)
+    data = await state.get_data()
+    code_type = data.get("code_type")
+    if code_type not in CODE_TYPES or db.get_stock_count(code_type) == 0:
+        await callback.message.edit_text(
+            "❌ Out of Stock\nNo codes available now.\nPlease check later or contact @animeverse23_requesting_bot"
+        )
+        await state.clear()
+        await callback.answer()
+        return
+    await callback.message.edit_text(
+        f"✅ Terms Accepted\n\n📦 {display_name(code_type)} Stock: {db.get_stock_count(code_type)} codes\nSelect quantity:",
+        reply_markup=get_quantity_keyboard(code_type)
+    )
+    await state.set_state(OrderStates.selecting_quantity)
+    await callback.answer()
+
+@router.callback_query(F.data == "terms_decline")
+async def terms_declined(callback: CallbackQuery, state: FSMContext):
+    await callback.message.edit_text("❌ You must accept the terms.\nUse /buy to start again.")
+    await state.clear()
+    await callback.answer()
+
+@router.callback_query(F.data == "check_stock")
+async def check_stock(callback: CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    code_type = data.get("code_type")
+    stock = db.get_stock_count(code_type)
+    await callback.answer(f"📦 Available: {stock} codes", show_alert=True)
+
+@router.callback_query(F.data == "cancel")
+async def cancel_action(callback: CallbackQuery, state: FSMContext):
+    await callback.message.edit_text("❌ Action cancelled\nUse /buy to start again")
+    await state.clear()
+    await callback.answer("Cancelled")
+
+@router.callback_query(F.data == "cancel_order")
+async def cancel_order(callback: CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    order_id = data.get("order_id")
+    if order_id:
+        async with order_locks.lock(order_id):
+            order = db.get_order(order_id)
+            if order and order.user_id == callback.from_user.id:
+                db.release_order(order_id, 'cancelled')
+    await callback.message.edit_text("❌ Order cancelled\nUse /buy to start again")
+    await state.clear()
+    await callback.answer("Cancelled")
+
+@router.callback_query(F.data.startswith("qty_"))
+async def quantity_selected(callback: CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    code_type = data.get("code_type")
+    qty_data = callback.data.split("_")[1]
+    if qty_data == "custom":
+        await callback.message.edit_text(
+            f"📝 Custom Quantity\nEnter codes you want ({display_name(code_type)}, per code rates apply).\nSend /cancel to go back."
+        )
+        await state.set_state(OrderStates.waiting_for_custom_quantity)
+        await callback.answer()
+        return
+    if code_type not in CODE_TYPES:
+        await state.clear()
+        await callback.answer("❌ This code type is no longer sold. Use /buy to start again.", show_alert=True)
+        return
+    pricing = CODE_TYPES[code_type]["pricing"]
+    # callback data comes from the client: only the catalog's own pack sizes are accepted here
+    quantity = int(qty_data) if qty_data.isdigit() else 0
+    if quantity not in pricing:
+        await callback.answer("❌ Invalid quantity", show_alert=True)
+        return
+    amount = pricing[quantity]
+    # the tier is fixed here: in multi-worker mode the db runs in the master, whose catalog isn't reloaded
+    order_id = db.create_order(
+        callback.from_user.id, callback.from_user.username or callback.from_user.first_name,
+        code_type, quantity, amount, quantity
+    )
+    if not order_id:
+        await callback.answer(
+            f"❌ Not enough stock! Only {db.get_stock_count(code_type)} available",
+            show_alert=True
+        )
+        return
+    await state.update_data(order_id=order_id, quantity=quantity, amount=amount)
+    msg = (
+        "📄 PAYMENT INVOICE\n"
+        f"Order ID: {order_id}\nType: {display_name(code_type)}\n"
+        f"Customer: {callback.from_user.full_name} (@{callback.from_user.username or 'none'})\n"
+        f"Quantity: {quantity} codes\nAmount: Rs.{amount}\n"
+        f"Pay to: {UPI_ID} (copy and pay via any UPI app) or click 'Pay Here' below.\n"
+        f"⏳ Codes reserved for {RESERVATION_TTL // 60} minutes.\n"
+        "After payment send UTR/Screenshot."
+    )
+    await callback.message.edit_text(msg)
+    await payment_qr.send(callback.message, amount, order_id, get_payment_keyboard(order_id))
+    await state.set_state(OrderStates.awaiting_payment)
+    await callback.answer("Invoice generated!")
+
+@router.message(OrderStates.waiting_for_custom_quantity)
+async def custom_quantity_entered(message: Message, state: FSMContext):
+    data = await state.get_data()
+    code_type = data.get("code_type")
+    if code_type not in CODE_TYPES:
+        await state.clear()
+        await message.answer("❌ This code type is no longer sold. Use /buy to start again.")
+        return
+    try:
+        quantity = int(message.text)
+        if quantity < 1 or quantity > 50:
+            await message.answer("❌ Min 1, Max 50 codes/order.")
+            return
+        pricing = CODE_TYPES[code_type]["pricing"]
+        amount = pricing[1] * quantity
+        order_id = db.create_order(
+            message.from_user.id, message.from_user.username or message.from_user.first_name,
+            code_type, quantity, amount, 1
+        )
+        if not order_id:
+            await message.answer(f"❌ Only {db.get_stock_count(code_type)} codes available")
+            return
+        await state.update_data(order_id=order_id, quantity=quantity, amount=amount)
+        msg = (
+            "📄 PAYMENT INVOICE\n"
+            f"Order: {order_id}\nType: {display_name(code_type)}\n"
+            f"Qty: {quantity}\nAmt: Rs.{amount}\n"
+            f"Pay to: {UPI_ID} (copy and pay via any UPI app) or click 'Pay Here' below.\n"
+            f"⏳ Codes reserved for {RESERVATION_TTL // 60} minutes.\n"
+            "After payment send UTR/Screenshot."
+        )
+        await message.answer(msg)
+        # Admin Notification for custom quantity order
+        notifier.new_order(
+            message.bot,
+            f"🆕 Custom Quantity Order\n"
+            f"User: @{message.from_user.username or message.from_user.full_name} (id={message.from_user.id})\n"
+            f"Type: {display_name(code_type)}\n"
+            f"Qty: {quantity} | Amt: Rs.{amount}\n"
+            f"Order ID: {order_id}\n"
+            f"Waiting for payment!"
+        )
+        await payment_qr.send(message, amount, order_id, get_payment_keyboard(order_id))
+        await state.set_state(OrderStates.awaiting_payment)
+    except ValueError:
+        await message.answer("❌ Please enter a valid number")
+
+@router.callback_query(F.data.startswith("sendproof_"))
+async def receive_proof_prompt(callback: CallbackQuery, state: FSMContext):
+    order_id = callback.data.split("_", 1)[1]
+    # the order id comes from callback data, which the client controls
+    order = db.get_order(order_id)
+    if not order or order.user_id != callback.from_user.id:
+        await callback.answer("❌ Order not found", show_alert=True)
+        return
+    await state.update_data(order_id=order_id)
+    await callback.message.answer(
+        "📤 Please send your payment screenshot as a photo or send the UTR/reference ID as text."
+    )
+    await state.set_state(OrderStates.waiting_for_proof)
+    await callback.answer("Send your UTR or screenshot below.")
+
+UTR_PATTERN = re.compile(r"\b\d{12}\b")
+REF_PATTERN = re.compile(r"\b(?=[A-Za-z0-9]*\d)[A-Za-z0-9]{10,22}\b")
+
+def normalize_utr(value): return re.sub(r"[^0-9A-Za-z]", "", value or "").upper()
+
+def extract_utr(text):
+    # UPI UTRs are 12 digits; fall back to any 10-22 character alphanumeric reference with a digit
+    if not text:
+        return None
+    match = UTR_PATTERN.search(text) or REF_PATTERN.search(text)
+    return match.group(0).upper() if match else None
+
+@router.message(OrderStates.waiting_for_proof)
+async def handle_payment_proof(message: Message, state: FSMContext):
+    data = await state.get_data()
+    order_id = data.get('order_id')
+    user = message.from_user
+    sent = False
+    approve_keyboard = get_admin_verify_keyboard(order_id)
+    utr = extract_utr(message.text or message.caption)
+    owner = db.set_order_utr(order_id, utr, user.id) if utr and order_id else None
+    utr_note = ""
+    if owner and owner != order_id:
+        utr_note = f"\n⚠️ UTR {utr} was already submitted for order {owner}"
+    elif owner:
+        utr_note = f"\n🔎 UTR {utr} will auto-verify on /reconcile"
+    if message.photo:
+        caption = (
+            f"📤 Payment screenshot for Order: {order_id}\n"
+            f"User: @{user.username or 'none'} ({user.full_name}, id={user.id})"
+            f"{utr_note}"
+        )
+        notifier.send(message.bot, caption, photo=message.photo[-1].file_id, reply_markup=approve_keyboard)
+        await message.answer("✅ Screenshot sent to admin! You will get the code after verification.")
+        sent = True
+    elif message.text:
+        caption = (
+            f"📤 UTR/Reference for Order: {order_id}\n"
+            f"User: @{user.username or 'none'} ({user.full_name}, id={user.id})\n"
+            f"UTR/Ref: {message.text}"
+            f"{utr_note}"
+        )
+        notifier.send(message.bot, caption, reply_markup=approve_keyboard)
+        await message.answer("✅ UTR sent to admin! You will get the code after verification.")
+        sent = True
+    if sent:
+        await state.clear()
+
+async def deliver_order(bot, order_id, limiter=None):
+    # claim (or reuse) the order's codes and message them to the customer, under the order lock;
+    # returns (outcome, order) with outcome one of missing, delivered_before, closed, no_stock,
+    # send_failed, delivered
+    async with order_locks.lock(order_id):
+        order = db.get_order(order_id)
+        if not order:
+            return 'missing', None
+        status = order.status
+        if status == 'delivered':
+            return 'delivered_before', order
+        if status in ('rejected', 'cancelled'):
+            return 'closed', order
+        ct = order.code_type
+        # everything that can fail is done before claim_codes commits the codes as sold
+        header = f"✅ PAYMENT VERIFIED!\nOrder: {order_id}\nType: {display_name(ct)}\n"
+        if status == 'paid':
+            # an earlier delivery attempt failed after the codes were claimed; resend the same codes
+            codes = order.codes
+        else:
+            codes = db.claim_codes(order_id)
+            if not codes:
+                # a customer's /cancel runs on their own worker, outside this lock
+                order = db.get_order(order_id)
+                if order.status in ('paid', 'delivered'):
+                    return 'delivered_before', order
+                if order.status in ('rejected', 'cancelled'):
+                    return 'closed', order
+                return 'no_stock', order
+            metrics.observe(
+                "bot_order_verify_seconds",
+                (datetime.now() - datetime.fromisoformat(order.created_at)).total_seconds(), code_type=ct
+            )
+        codes_text = "\n".join([f"{i+1}. {code}" for i, code in enumerate(codes)])
+        text = f"{header}Your Codes:\n{codes_text}\nThank you!"
+        for _ in range(BROADCAST_RETRIES):
+            if limiter:
+                await limiter.wait()
+            try:
+                await bot.send_message(order.user_id, text)
+                break
+            except TelegramRetryAfter as e:
+                if not limiter:
+                    return 'send_failed', order
+                limiter.hold(e.retry_after)
+            except Exception as e:
+                logging.warning("Delivery of %s failed: %s", order_id, e)
+                return 'send_failed', order
+        else:
+            return 'send_failed', order
+        db.mark_delivered(order_id)
+    return 'delivered', order
+
+@router.callback_query(F.data.startswith("verify_"))
+async def admin_verify_payment(callback: CallbackQuery, state: FSMContext):
+    if callback.from_user.id not in ADMIN_USER_IDS:
+        await callback.answer("❌ Unauthorized", show_alert=True)
+        return
+    order_id = callback.data.split("_", 1)[1]
+    outcome, order = await deliver_order(callback.bot, order_id)
+    if outcome == 'missing':
+        await callback.answer("❌ Order not found", show_alert=True)
+    elif outcome == 'delivered_before':
+        await callback.answer("⚠️ Codes already sent for this order.", show_alert=True)
+    elif outcome == 'closed':
+        await callback.answer(f"⚠️ Order is {order.status}.", show_alert=True)
+    elif outcome == 'no_stock':
+        await callback.answer("❌ Not enough codes!", show_alert=True)
+        await callback.message.edit_text(f"❌ INSUFFICIENT STOCK for order {order_id}")
+    elif outcome == 'send_failed':
+        await callback.answer("❌ Could not message the customer. Tap confirm again to retry.", show_alert=True)
+    else:
+        await callback.message.edit_text(
+            f"✅ Codes delivered for {order_id}.\nCustomer notified."
+        )
+        await callback.answer("✅ Codes delivered!", show_alert=True)
+
+@router.callback_query(F.data.startswith("reject_"))
+async def admin_reject_payment(callback: CallbackQuery, state: FSMContext):
+    if callback.from_user.id not in ADMIN_USER_IDS:
+        await callback.answer("❌ Unauthorized", show_alert=True)
+        return
+    order_id = callback.data.split("_", 1)[1]
+    async with order_locks.lock(order_id):
+        order = db.get_order(order_id)
+        if not order:
+            await callback.answer("❌ Order not found", show_alert=True)
+            return
+        if order.status == 'rejected':
+            await callback.answer("⚠️ Order already rejected.", show_alert=True)
+            return
+        if not db.release_order(order_id, 'rejected'):
+            await callback.answer(f"⚠️ Order is {order.status}, cannot reject.", show_alert=True)
+            return
+        await callback.bot.send_message(
+            order.user_id,
+            f"❌ Payment not verified.\nOrder: {order_id}\nContact admin: @animeverse23_requesting_bot with your payment details."
+        )
+    await callback.message.edit_text(f"❌ Order {order_id} rejected.\nCustomer notified.")
+    await callback.answer("Rejected")
+
+async def iter_document_lines(bot, file_id):
+    # streams the file in chunks and yields the complete lines of each chunk
+    file = await bot.get_file(file_id)
+    url = bot.session.api.file_url(bot.token, file.file_path)
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    tail = ""
+    async for chunk in bot.session.stream_content(url):
+        text = tail + decoder.decode(chunk)
+        lines = text.splitlines()
+        tail = lines.pop() if lines and text[-1] not in "\r\n" else ""
+        yield lines
+    tail += decoder.decode(b"", final=True)
+    if tail:
+        yield [tail]
+
+def parse_code_line(line):
+    # TXT: one code per line; CSV: the code is the first column
+    return line.split(",", 1)[0].strip().strip('"').strip()
+
+async def import_codes_document(message, code_type):
+    doc = message.document
+    name = doc.file_name or "document"
+    if not name.lower().endswith((".txt", ".csv")):
+        await message.answer("❌ Send a .txt or .csv file with one code per line.")
+        return
+    progress = await message.answer(f"📥 Importing {name} into {display_name(code_type)}...")
+    added = duplicates = already_delivered = codes_read = 0
+    batch = []
+    first = True
+    last_report = time.monotonic()
+    def apply(codes):
+        nonlocal added, duplicates, already_delivered
+        a, d, x = db.import_codes(code_type, codes)
+        added, duplicates, already_delivered = added + a, duplicates + d, already_delivered + x
+    def summary():
+        return (
+            f"Codes read: {codes_read} | Added: {added} | Duplicates: {duplicates} | Already delivered: {already_delivered}\n"
+            f"Stock: {db.get_stock_count(code_type)}"
+        )
+    try:
+        async for lines in iter_document_lines(message.bot, doc.file_id):
+            for line in lines:
+                code = parse_code_line(line)
+                if not code:
+                    continue
+                if first:
+                    first = False
+                    if code.lower() in ("code", "codes"):
+                        continue
+                codes_read += 1
+                batch.append(code)
+            if len(batch) >= CODE_IMPORT_BATCH:
+                apply(batch)
+                batch = []
+                await asyncio.sleep(0)
+            if time.monotonic() - last_report >= CODE_IMPORT_REPORT_INTERVAL:
+                last_report = time.monotonic()
+                try:
+                    await progress.edit_text(f"📥 Importing {name}...\n{summary()}")
+                except TelegramBadRequest:
+                    pass
+        if batch:
+            apply(batch)
+    except (TelegramBadRequest, ClientError) as e:
+        await progress.edit_text(f"❌ Import of {name} failed: {e}\n{summary()}")
+        return
+    await progress.edit_text(f"✅ Imported {name} into {display_name(code_type)}\n{summary()}")
+
+@router.message(Command("addcode"))
+async def add_code(message: Message, state: FSMContext):
+    if message.from_user.id not in ADMIN_USER_IDS:
+        await message.answer("❌ Admin only command")
+        return
+    if message.document:
+        args = (message.caption or "").split()
+        if len(args) < 2 or args[1] not in CODE_TYPES:
+            await message.answer(f"Usage: upload a .txt/.csv with caption /addcode [{'|'.join(CODE_TYPES)}]")
+            return
+        await import_codes_document(message, args[1])
+        return
+    if not message.text:
+        return
+    args = message.text.split(None, 2)
+    if len(args) < 3 or args[1] not in CODE_TYPES:
+        await message.answer(
+            f"Usage: /addcode [{'|'.join(CODE_TYPES)}] CODE1\\nCODE2\\n... (paste one per line after a space!)"
+        )
+        return
+    code_type = args[1]
+    codes_list = [c.strip() for c in args[2].split('\n') if c.strip()]
+    added = db.add_codes_from_channel(code_type, codes_list)
+    await message.answer(
+        f"✅ Added: {added} codes to {display_name(code_type)}. Stock: {db.get_stock_count(code_type)}."
+    )
+
+# Bank/UPI statement CSVs differ per bank: the header row is found by column names (anything
+# above it is preamble), credits are taken from a credit/deposit column or else the amount column,
+# and when there is no reference column the 12-digit UTR is pulled out of the narration.
+class StatementParser:
+    UTR_COLUMNS = ('utr', 'rrn', 'ref', 'transaction id', 'txn id')
+    NARRATION_COLUMNS = ('description', 'narration', 'remarks', 'particulars', 'details')
+    def __init__(self):
+        self.columns = None
+        self.entries = {}
+        self.rows = self.duplicates = self.skipped = 0
+    @staticmethod
+    def _find(cells, keys):
+        return next((i for i, cell in enumerate(cells) if any(k in cell for k in keys)), None)
+    def _detect(self, row):
+        cells = [cell.strip().lower() for cell in row]
+        amount = self._find(cells, ('credit', 'deposit'))
+        if amount is None:
+            amount = next((i for i, cell in enumerate(cells) if 'amount' in cell or cell in ('cr', 'amt')), None)
+        utr, narration = self._find(cells, self.UTR_COLUMNS), self._find(cells, self.NARRATION_COLUMNS)
+        if amount is None or (utr is None and narration is None):
+            return None
+        return utr, narration, amount, self._find(cells, ('date', 'time'))
+    @staticmethod
+    def parse_amount(value):
+        value = re.sub(r"(?i)(rs\.?|inr|₹|cr\.?$|,|\s)", "", value or "")
+        try:
+            paise = round(float(value) * 100)
+        except ValueError:
+            return None
+        return paise if paise > 0 else None
+    def feed(self, lines):
+        for row in csv.reader(lines):
+            if not any(cell.strip() for cell in row):
+                continue
+            if self.columns is None:
+                self.columns = self._detect(row)
+                continue
+            self.rows += 1
+            utr_col, narration_col, amount_col, time_col = self.columns
+            cell = lambda i: row[i] if i is not None and i < len(row) else ""
+            match = UTR_PATTERN.search(cell(utr_col)) or UTR_PATTERN.search(cell(narration_col))
+            utr = match.group(0) if match else normalize_utr(cell(utr_col))
+            paise = self.parse_amount(cell(amount_col))
+            if len(utr) < 10 or paise is None:
+                self.skipped += 1
+            elif utr in self.entries:
+                self.duplicates += 1
+            else:
+                self.entries[utr] = (paise, cell(time_col).strip())
+
+async def deliver_matched(bot, order_ids):
+    limiter = RateLimiter(BROADCAST_RATE)
+    outcomes = {}
+    pending = iter(order_ids)
+    async def worker():
+        for order_id in pending:
+            outcome, _ = await deliver_order(bot, order_id, limiter)
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    await asyncio.gather(*(worker() for _ in range(RECONCILE_CONCURRENCY)))
+    return outcomes
+
+@router.message(Command("reconcile"))
+async def reconcile_statement(message: Message, state: FSMContext):
+    if message.from_user.id not in ADMIN_USER_IDS:
+        await message.answer("❌ Admin only command")
+        return
+    doc = message.document
+    if not doc or not (doc.file_name or "").lower().endswith(".csv"):
+        await message.answer("Usage: upload your bank/UPI statement .csv with caption /reconcile")
+        return
+    progress = await message.answer(f"🧾 Reading {doc.file_name}...")
+    parser = StatementParser()
+    try:
+        async for lines in iter_document_lines(message.bot, doc.file_id):
+            parser.feed(lines)
+            await asyncio.sleep(0)
+    except (TelegramBadRequest, ClientError, csv.Error) as e:
+        await progress.edit_text(f"❌ Could not read {doc.file_name}: {e}")
+        return
+    if parser.columns is None:
+        await progress.edit_text("❌ No header with a UTR/reference (or narration) column and an amount/credit column found.")
+        return
+    result = db.match_statement(parser.entries)
+    await progress.edit_text(f"🧾 {len(parser.entries)} UTRs read, delivering {len(result['matched'])} matched orders...")
+    outcomes = await deliver_matched(message.bot, result['matched'])
+    mismatched = result['mismatched']
+    await progress.edit_text(
+        f"🧾 Reconciled {doc.file_name}\n"
+        f"Rows: {parser.rows} | UTRs: {len(parser.entries)} | Skipped: {parser.skipped} | Duplicate UTRs: {parser.duplicates}\n"
+        f"✅ Auto-verified: {outcomes.get('delivered', 0)}\n"
+        f"⚠️ Amount mismatch: {len(mismatched)}\n"
+        f"❌ Delivery failed: {outcomes.get('send_failed', 0)} | Out of stock: {outcomes.get('no_stock', 0)}\n"
+        f"Already closed: {result['closed'] + outcomes.get('delivered_before', 0) + outcomes.get('closed', 0)} | "
+        f"Not ours: {result['unknown']} | Open orders with UTR not in statement: {result['missing']}"
+    )
+    for order_id, utr, amount, paise, when in mismatched[:RECONCILE_REVIEW_LIMIT]:
+        await message.answer(
+            f"⚠️ Review {order_id}\nUTR: {utr} {when}\nExpected Rs.{amount}, statement Rs.{paise / 100:.2f}",
+            reply_markup=get_admin_verify_keyboard(order_id)
+        )
+    if len(mismatched) > RECONCILE_REVIEW_LIMIT:
+        await message.answer(f"…and {len(mismatched) - RECONCILE_REVIEW_LIMIT} more mismatches, see /pending.")
+
+@router.message(Command("reload"))
+async def reload_catalog_cmd(message: Message, state: FSMContext):
+    if message.from_user.id not in ADMIN_USER_IDS:
+        await message.answer("❌ Admin only command")
+        return
+    global catalog_version
+    try:
+        reload_catalog()
+    except (OSError, ValueError, KeyError) as e:
+        await message.answer(f"❌ Catalog reload failed: {e}")
+        return
+    catalog_version = db.bump_catalog_version()
+    await message.answer(f"✅ Catalog reloaded: {', '.join(item['display'] for item in CODE_TYPES.values())}")
+
+@router.message(Command("stock"))
+async def check_stock(message: Message, state: FSMContext):
+    reserved = db.get_reserved_count()
+    text = stock_text_with_reserved(stock_counts(), tuple(reserved.get(k, 0) for k in CODE_TYPES))
+    if message.from_user.id in ADMIN_USER_IDS:
+        stats = db.get_stats()
+        users = db.get_user_stats()
+        today = db.get_report(date.today(), date.today())['total']
+        await message.answer(
+            f"📊 INVENTORY & SALES\n{text}\n"
+            f"Orders: {stats['total']} | Paid: {stats['paid']} | Pending: {stats['pending']}\n"
+            f"Revenue: Rs.{stats['revenue']} | Today: {today[1]} paid, Rs.{today[2]}\n"
+            f"Users: {users['users']} | Customers: {users['buyers']} | Blocked: {users['blocked']}\n"
+            f"Use /pending to view waiting for verification."
+        )
+    else:
+        await message.answer(f"Stock:\n{text}\nUse /buy to order.")
+
+# Streams the orders of a date range as CSV while it uploads, one page of orders per chunk
+def order_pages(start, end, limit=EXPORT_PAGE_SIZE):
+    # the in-memory ids are snapshotted first: an order archived mid-export is skipped by the
+    # archive pass and still found by id in the memory pass, so nothing is missed or repeated
+    ids = db.get_order_ids_between(start, end)
+    live, after = set(ids), ''
+    while True:
+        rows = db.get_archived_between(start, end, after, limit)
+        if rows:
+            after = rows[-1][0]
+        yield [row for row in rows if row[0] not in live]
+        if len(rows) < limit:
+            break
+    for i in range(0, len(ids), limit):
+        yield db.get_orders(ids[i:i + limit])
+
+class OrdersCSV(InputFile):
+    COLUMNS = ('order_id', 'created_at', 'user_id', 'username', 'code_type', 'quantity', 'amount', 'status', 'verified_at', 'utr')
+    def __init__(self, start, end):
+        super().__init__(filename=f"orders_{start}_{end}.csv")
+        self.start, self.end = start, end
+    async def read(self, bot):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(self.COLUMNS)
+        for rows in order_pages(self.start, self.end):
+            writer.writerows((order_id, *(getattr(order, name) for name in self.COLUMNS[1:])) for order_id, order in rows)
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+            await asyncio.sleep(0)
+
+def parse_report_range(args, today):
+    # nothing = today | DAYS = the last DAYS days | DATE [DATE] (YYYY-MM-DD, inclusive)
+    try:
+        if not args:
+            start = end = today
+        elif len(args) == 1 and args[0].isdigit():
+            start, end = today - timedelta(days=int(args[0]) - 1), today
+        elif len(args) <= 2:
+            start, end = date.fromisoformat(args[0]), date.fromisoformat(args[-1])
+        else:
+            return None
+    except (ValueError, OverflowError):
+        return None
+    if start > end or (end - start).days >= REPORT_MAX_DAYS:
+        return None
+    return start, end
+
+def format_sales(counts):
+    invoices, paid, revenue, verify_seconds = counts
+    line = f"{invoices} invoices, {paid} paid"
+    if invoices:
+        line += f" ({paid / invoices:.0%})"
+    line += f", Rs.{revenue}"
+    if paid:
+        line += f", verified in {format_age(verify_seconds // paid)} avg"
+    return line
+
+def format_report(start, end, report):
+    lines = [f"📈 Sales {start}" + (f" to {end}" if end != start else ""), format_sales(report['total'])]
+    if report['by_type']:
+        lines += ["", "By type:"]
+        lines += [f"{display_name(k)}: {format_sales(v)}" for k, v in sorted(report['by_type'].items())]
+        lines += ["", "By pack:"]
+        lines += [f"{'Per code' if k == 1 else f'{k} codes'}: {format_sales(v)}" for k, v in sorted(report['by_tier'].items())]
+        lines += ["", "By hour:" if report['level'] == 'hour' else "By day:"]
+        lines += [f"{key[-2:] + ':00' if report['level'] == 'hour' else key}: {format_sales(v)}" for key, v in report['rows']]
+    else:
+        lines.append("No sales in this period.")
+    # a year of daily rows doesn't fit one message
+    messages, chunk, size = [], [], 0
+    for line in lines:
+        if size + len(line) + 1 > 4000:
+            messages.append("\n".join(chunk))
+            chunk, size = [], 0
+        chunk.append(line)
+        size += len(line) + 1
+    messages.append("\n".join(chunk))
+    return messages
+
+@router.message(Command("report"))
+async def sales_report(message: Message, state: FSMContext):
+    if message.from_user.id not in ADMIN_USER_IDS:
+        await message.answer("❌ Admin only command")
+        return
+    args = message.text.split()[1:]
+    export = bool(args) and args[-1].lower() == "csv"
+    span = parse_report_range(args[:-1] if export else args, date.today())
+    if not span:
+        await message.answer(
+            f"❌ Usage: /report [DAYS | YYYY-MM-DD [YYYY-MM-DD]] [csv]\nRanges up to {REPORT_MAX_DAYS} days."
+        )
+        return
+    start, end = span
+    for text in format_report(start, end, db.get_report(start, end)):
+        await message.answer(text)
+    if export:
+        try:
+            await message.answer_document(OrdersCSV(start, end), caption=f"🧾 Orders {start} to {end}")
+        except (TelegramBadRequest, ClientError) as e:
+            await message.answer(f"❌ Export failed: {e}")
+
+@router.message(Command("pending"))
+async def pending_orders(message: Message, state: FSMContext):
+    if message.from_user.id not in ADMIN_USER_IDS:
+        await message.answer("❌ Admin only command")
+        return
+    if not db.get_stats()['pending']:
+        await message.answer("✅ No pending orders.")
+        return
+    text, keyboard = render_pending_page(0)
+    await message.answer(text, reply_markup=keyboard)
+
+@router.callback_query(F.data.startswith("pending_"))
+async def pending_page(callback: CallbackQuery, state: FSMContext):
+    if callback.from_user.id not in ADMIN_USER_IDS:
+        await callback.answer("❌ Unauthorized", show_alert=True)
+        return
+    _, offset, code_type, min_age = callback.data.split("_")
+    text, keyboard = render_pending_page(int(offset), None if code_type == 'all' else code_type, int(min_age))
+    try:
+        await callback.message.edit_text(text, reply_markup=keyboard)
+    except TelegramBadRequest:
+        pass
+    await callback.answer()
+
+def parse_segment(args):
+    # all | buyers | never | active DAYS | inactive DAYS | bought CODE_TYPE [DAYS]
+    name, rest = (args[0], args[1:]) if args else ('all', [])
+    if name not in USER_SEGMENTS:
+        return None
+    code_type = None
+    if name == 'bought':
+        if not rest or rest[0] not in CODE_TYPES:
+            return None
+        code_type, rest = rest[0], rest[1:]
+    if rest and (len(rest) > 1 or not rest[0].isdigit() or name in ('all', 'buyers', 'never')):
+        return None
+    return name, code_type, int(rest[0]) if rest else 30
+
+def describe_segment(name, code_type, days):
+    return {
+        'all': "all users", 'buyers': "customers", 'never': "users who never bought",
+        'active': f"users seen in the last {days} days", 'inactive': f"users not seen for {days} days",
+        'bought': f"{display_name(code_type)} buyers in the last {days} days",
+    }[name]
+
+@router.message(Command("sendall"))
+async def broadcast_start(message: Message, state: FSMContext):
+    if message.from_user.id not in ADMIN_USER_IDS:
+        await message.answer("❌ Admin only command")
+        return
+    segment = parse_segment(message.text.split()[1:])
+    if not segment:
+        await message.answer(
+            "❌ Usage: /sendall [segment]\n"
+            "all | buyers | never | active DAYS | inactive DAYS | bought CODE_TYPE [DAYS]"
+        )
+        return
+    audience = len(db.get_segment(*segment))
+    await state.update_data(segment=list(segment))
+    await state.set_state(OrderStates.broadcast_message)
+    await message.answer(
+        f"🎯 Audience: {describe_segment(*segment)} ({audience} users)\n"
+        "Send the message (text or photo) you want to broadcast:"
+    )
+
+@router.message(OrderStates.broadcast_message)
+async def broadcast_message(message: Message, state: FSMContext):
+    data = await state.get_data()
+    await state.clear()
+    if broadcaster.busy:
+        await message.answer("⚠️ A broadcast is already in progress.")
+        return
+    if message.text:
+        payload = {'text': message.text}
+    elif message.photo:
+        payload = {'photo': message.photo[-1].file_id, 'caption': message.caption or ''}
+    else:
+        await message.answer("❌ Only text or photo can be broadcast.")
+        return
+    users = sorted(set(db.get_segment(*data.get('segment', ('all', None, 30)))) - set(ADMIN_USER_IDS))
+    job = BroadcastJob(message.chat.id, None, payload, users)
+    # ~0.6s of JSON at a million users; keep it off the event loop
+    await asyncio.to_thread(job.save_users)
+    progress = await message.answer(job.progress_text(), reply_markup=get_broadcast_keyboard(job.status))
+    job.progress_message_id = progress.message_id
+    broadcaster.start(message.bot, job)
+
+@router.callback_query(F.data.in_({"bc_pause", "bc_resume", "bc_cancel"}))
+async def broadcast_control(callback: CallbackQuery, state: FSMContext):
+    if callback.from_user.id not in ADMIN_USER_IDS:
+        await callback.answer("❌ Unauthorized", show_alert=True)
+        return
+    job = broadcaster.job
+    if not job:
+        await callback.answer("No active broadcast.", show_alert=True)
+        return
+    action = callback.data
+    if action == "bc_pause":
+        broadcaster.pause()
+        await callback.answer("Pausing...")
+    elif action == "bc_resume":
+        if job.status != 'paused' or (broadcaster.task and not broadcaster.task.done()):
+            await callback.answer("Broadcast is not paused.")
+            return
+        job.progress_message_id = callback.message.message_id
+        broadcaster.start(callback.bot, job)
+        await callback.answer("Resumed")
+    else:
+        if broadcaster.task and not broadcaster.task.done():
+            broadcaster.cancel()
+        else:
+            job.status = 'cancelled'
+            job.discard()
+            broadcaster.job = None
+            await callback.message.edit_text(job.progress_text())
+        await callback.answer("Cancelled")
+
+@router.message(Command("setqr"))
+async def set_qr(message: Message, state: FSMContext):
+    if message.from_user.id not in ADMIN_USER_IDS:
+        await message.answer("❌ Admin only command")
+        return
+    await state.set_state(OrderStates.waiting_for_qr)
+    await message.answer("📸 Send your UPI QR image now. (As photo, not file)")
+
+@router.message(OrderStates.waiting_for_qr, F.photo)
+async def receive_qr(message: Message, state: FSMContext):
+    await state.clear()
+    try:
+        photo = message.photo[-1]
+        file = await message.bot.get_file(photo.file_id)
+        await message.bot.download_file(file.file_path, UPI_QR_FILE)
+        payment_qr.remember(UPI_QR_FILE, photo.file_id)
+        if UPI_ID:
+            await message.answer("✅ QR Code saved. Invoices use generated QRs for UPI_ID; this one is the fallback.")
+        else:
+            await message.answer("✅ QR Code updated and will be sent to new buyers!")
+    except Exception as e:
+        await message.answer(f"❌ QR upload failed: {str(e)}")
+
+@router.message(OrderStates.waiting_for_qr)
+async def receive_qr_invalid(message: Message, state: FSMContext):
+    await state.clear()
+    await message.answer("❌ No photo received, QR not changed. Use /setqr to try again.")
+
+async def reservation_reaper():
+    while True:
+        await asyncio.sleep(RESERVATION_REAP_INTERVAL)
+        while released := db.release_expired(RESERVATION_REAP_BATCH):
+            logging.info("Released %d expired reservations", len(released))
+            await asyncio.sleep(0)
+
+async def order_archiver():
+    if not ORDER_ARCHIVE_AGE or not DB_PATH:
+        return
+    while True:
+        while order_ids := db.archive_orders(ORDER_ARCHIVE_BATCH):
+            # waiting for the writer happens off the event loop and outside LockedDB's lock
+            await asyncio.to_thread(db.backend.flush)
+            db.drop_archived(order_ids)
+            logging.info("Archived %d orders", len(order_ids))
+        await asyncio.sleep(ORDER_ARCHIVE_INTERVAL)
+
+class DrainingRequestHandler(SimpleRequestHandler):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ready = False
+        self.draining = False
+    async def handle(self, request):
+        if self.draining:
+            return web.Response(status=503, text="shutting down")
+        return await super().handle(request)
+    async def close(self):
+        # runs on app shutdown, before the dispatcher's own shutdown hooks;
+        # the bot session is closed later, on cleanup
+        self.ready = False
+        self.draining = True
+        tasks = set(self._background_feed_update_tasks)
+        if tasks:
+            logging.info("Draining %d in-flight updates", len(tasks))
+            await asyncio.wait(tasks, timeout=WEBHOOK_DRAIN_TIMEOUT)
+
+async def serve_metrics(request):
+    return web.Response(body=metrics.render().encode(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+async def start_metrics_server():
+    app = web.Application()
+    app.router.add_get("/metrics", serve_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, METRICS_PORT).start()
+    return runner
+
+def build_webhook_app(bot, dp, **data):
+    handler = DrainingRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET or None, **data)
+    app = web.Application()
+    handler.register(app, path=WEBHOOK_PATH)
+    async def healthz(request): return web.Response(text="ok")
+    async def readyz(request):
+        return web.Response(text="ready") if handler.ready else web.Response(status=503, text="not ready")
+    app.router.add_get("/healthz", healthz)
+    app.router.add_get("/readyz", readyz)
+    app.router.add_get("/metrics", serve_metrics)
+    setup_application(app, dp, bot=bot, **data)
+    async def close_session(app): await bot.session.close()
+    app.on_cleanup.append(close_session)
+    app['handler'] = handler
+    return app
+
+async def wait_for_stop_signal():
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+async def set_webhook(bot, dp):
+    if WEBHOOK_URL:
+        await bot.set_webhook(
+            WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=dp.resolve_used_update_types()
+        )
+
+async def run_webhook(bot, dp, host=WEBHOOK_HOST, port=WEBHOOK_PORT, register=True):
+    app = build_webhook_app(bot, dp)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    if register:
+        await set_webhook(bot, dp)
+    app['handler'].ready = True
+    logging.info("Webhook server listening on %s:%s%s", host, port, WEBHOOK_PATH)
+    try:
+        await wait_for_stop_signal()
+    finally:
+        # stops accepting connections, then the handler drains in-flight updates
+        await runner.cleanup()
+
+# Consistent hashing: each worker owns HASH_RING_REPLICAS points on a crc32 ring, so changing
+# BOT_WORKERS only moves the users whose arc changed owner
+class HashRing:
+    def __init__(self, nodes, replicas=HASH_RING_REPLICAS):
+        points = sorted((zlib.crc32(f"{node}:{i}".encode()), node) for node in nodes for i in range(replicas))
+        self.hashes = [h for h, _ in points]
+        self.nodes = [node for _, node in points]
+    def node(self, key):
+        return self.nodes[bisect_left(self.hashes, zlib.crc32(str(key).encode())) % len(self.nodes)]
+
+def shard_key(update):
+    # a user's updates always land on the same worker, which holds their FSM state
+    for event in update.values():
+        if not isinstance(event, dict):
+            continue
+        user = event.get('from') or event.get('user') or event.get('chat')
+        if user:
+            return user['id']
+    return 0
+
+def worker_for(update, ring):
+    key = shard_key(update)
+    # all admin updates go to worker 0: it owns the broadcaster (/sendall, the bc_* taps and the
+    # job restored after a restart), and verify/reject taps and /reconcile share its order locks
+    return 0 if key in ADMIN_USER_IDS else ring.node(key)
+
+def worker_url(index, path): return f"http://127.0.0.1:{WEBHOOK_PORT + 1 + index}{path}"
+
+async def wait_for_workers(client, workers):
+    deadline = time.monotonic() + WORKER_READY_TIMEOUT
+    for index, process in enumerate(workers):
+        while True:
+            if not process.is_alive():
+                raise RuntimeError(f"Worker {index} exited with code {process.exitcode}")
+            try:
+                async with client.get(worker_url(index, "/readyz")) as resp:
+                    if resp.status == 200:
+                        break
+            except ClientError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"Worker {index} not ready after {WORKER_READY_TIMEOUT}s")
+            await asyncio.sleep(0.2)
+
+def merge_metrics(sources):
+    # sources are (worker label, exposition text), None for the master's own; each family keeps a
+    # single TYPE line, worker samples get a worker label, and the workers' gauges are dropped
+    # since they all read the master's db and the master already reports them
+    families, family = {}, None
+    for worker, text in sources:
+        for line in text.splitlines():
+            if line.startswith("# TYPE "):
+                _, _, name, kind = line.split()
+                family = None if worker is not None and kind == "gauge" else families.setdefault(name, [line])
+            elif line and family is not None:
+                if worker is not None:
+                    head, value = line.rsplit(" ", 1)
+                    head = f'{head[:-1]},worker="{worker}"}}' if head.endswith("}") else f'{head}{{worker="{worker}"}}'
+                    line = f"{head} {value}"
+                family.append(line)
+    return "".join(line + "\n" for lines in families.values() for line in lines)
+
+def build_master_app(client, ring):
+    app = web.Application()
+    targets = [worker_url(i, WEBHOOK_PATH) for i in range(BOT_WORKERS)]
+    headers = {"X-Telegram-Bot-Api-Secret-Token": WEBHOOK_SECRET} if WEBHOOK_SECRET else {}
+    async def route(request):
+        if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+            return web.Response(status=401, text="Unauthorized")
+        body = await request.read()
+        try:
+            target = targets[worker_for(json.loads(body), ring)]
+            async with client.post(target, data=body, headers={**headers, "Content-Type": "application/json"}) as resp:
+                status = resp.status
+        except (ClientError, asyncio.TimeoutError) as e:
+            logging.warning("Forwarding update failed: %s", e)
+            status = 503
+        except ValueError:
+            return web.Response(status=400, text="bad update")
+        # anything but 200 makes Telegram redeliver the update later
+        return web.Response(status=status)
+    async def scrape(index):
+        try:
+            async with client.get(worker_url(index, "/metrics")) as resp:
+                return str(index), await resp.text()
+        except (ClientError, asyncio.TimeoutError) as e:
+            logging.warning("Scraping worker %d metrics failed: %s", index, e)
+            return str(index), ""
+    async def serve_all_metrics(request):
+        sources = [(None, metrics.render())] + list(await asyncio.gather(*map(scrape, range(BOT_WORKERS))))
+        return web.Response(body=merge_metrics(sources).encode(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+    async def healthz(request): return web.Response(text="ok")
+    async def readyz(request):
+        ready = app['ready'].is_set() and all(p.is_alive() for p in app['workers'])
+        return web.Response(text="ready") if ready else web.Response(status=503, text="not ready")
+    app.router.add_post(WEBHOOK_PATH, route)
+    app.router.add_get("/healthz", healthz)
+    app.router.add_get("/readyz", readyz)
+    app.router.add_get("/metrics", serve_all_metrics)
+    app['ready'] = asyncio.Event()
+    return app
+
+async def run_master(bot, dp):
+    global db
+    db = LockedDB(db)
+    os.environ["BOT_SHARED_STORE"] = serve_shared_store(db)
+    # spawn, not fork: workers must not inherit the db writer thread or the event loop
+    ctx = multiprocessing.get_context("spawn")
+    workers = [ctx.Process(target=run_worker, args=(i,), name=f"bot-worker-{i}") for i in range(BOT_WORKERS)]
+    for process in workers:
+        process.start()
+    client = ClientSession(timeout=ClientTimeout(total=WEBHOOK_DRAIN_TIMEOUT))
+    app = build_master_app(client, HashRing(range(BOT_WORKERS)))
+    app['workers'] = workers
+    runner = web.AppRunner(app)
+    try:
+        await wait_for_workers(client, workers)
+        await runner.setup()
+        await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+        await set_webhook(bot, dp)
+        app['ready'].set()
+        logging.info("Routing %s%s to %d workers", WEBHOOK_PORT, WEBHOOK_PATH, BOT_WORKERS)
+        await wait_for_stop_signal()
+    finally:
+        await runner.cleanup()
+        await client.close()
+        await bot.session.close()
+        # each worker drains its in-flight updates on SIGTERM
+        for process in workers:
+            if process.is_alive():
+                process.terminate()
+        for process in workers:
+            await asyncio.to_thread(process.join, WEBHOOK_DRAIN_TIMEOUT + 5)
+
+async def catalog_watcher():
+    # /reload runs on a single worker; the others follow the version it bumps in the shared db
+    global catalog_version
+    catalog_version = db.get_catalog_version()
+    while True:
+        await asyncio.sleep(CATALOG_SYNC_INTERVAL)
+        version = db.get_catalog_version()
+        if version == catalog_version:
+            continue
+        catalog_version = version
+        try:
+            reload_catalog()
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning("Catalog reload failed: %s", e)
+
+async def worker_main(index):
+    bot = create_bot()
+    dp = create_dispatcher()
+    if index == 0:
+        await broadcaster.restore(bot)
+    watcher = asyncio.create_task(catalog_watcher())
+    try:
+        await run_webhook(bot, dp, "127.0.0.1", WEBHOOK_PORT + 1 + index, register=False)
+    finally:
+        watcher.cancel()
+
+def run_worker(index):
+    logging.basicConfig(level=logging.INFO, format=f'%(asctime)s - worker{index} - %(levelname)s - %(message)s')
+    asyncio.run(worker_main(index))
+
+def create_bot():
+    session = AiohttpSession(api=TelegramAPIServer.from_base(BOT_API_URL)) if BOT_API_URL else AiohttpSession()
+    session.middleware(BotAPIMetricsMiddleware())
+    return Bot(token=BOT_TOKEN, session=session)
+
+def create_dispatcher():
+    dp = Dispatcher(storage=SQLiteStorage(FSM_DB_PATH) if FSM_DB_PATH else MemoryStorage())
+    dp.include_router(router)
+    dp.shutdown.register(notifier.close)
+    return dp
+
+async def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    bot = create_bot()
+    dp = create_dispatcher()
+    multi_worker = BOT_MODE == "webhook" and BOT_WORKERS > 1
+    if not multi_worker:
+        await broadcaster.restore(bot)
+    reaper = asyncio.create_task(reservation_reaper())
+    archiver = asyncio.create_task(order_archiver())
+    print(f"🤖 Bot started ({BOT_MODE}{f', {BOT_WORKERS} workers' if multi_worker else ''})!")
+    try:
+        if multi_worker:
+            await run_master(bot, dp)
+        elif BOT_MODE == "webhook":
+            await run_webhook(bot, dp)
+        else:
+            metrics_runner = await start_metrics_server() if METRICS_PORT else None
+            await bot.delete_webhook()
+            try:
+                await dp.start_polling(bot)
+            finally:
+                if metrics_runner:
+                    await metrics_runner.cleanup()
+    finally:
+        reaper.cancel()
+        archiver.cancel()
+        db.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
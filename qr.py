@@ -0,0 +1,286 @@
+import struct
+import zlib
+from functools import lru_cache
+
+# Pure-Python QR Code encoder (ISO/IEC 18004, byte mode, versions 1-40) with a minimal PNG writer.
+# Tables are indexed [error correction level][version]; index 0 is unused.
+ECC_LEVELS = ('L', 'M', 'Q', 'H')
+FORMAT_BITS = {'L': 1, 'M': 0, 'Q': 3, 'H': 2}
+ECC_CODEWORDS_PER_BLOCK = (
+    (-1, 7, 10, 15, 20, 26, 18, 20, 24, 30, 18, 20, 24, 26, 30, 22, 24, 28, 30, 28, 28, 28, 28, 30, 30, 26, 28, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),
+    (-1, 10, 16, 26, 18, 24, 16, 18, 22, 22, 26, 30, 22, 22, 24, 24, 28, 28, 26, 26, 26, 26, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28, 28),
+    (-1, 13, 22, 18, 26, 18, 24, 18, 22, 20, 24, 28, 26, 24, 20, 30, 24, 28, 28, 26, 30, 28, 30, 30, 30, 30, 28, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),
+    (-1, 17, 28, 22, 16, 22, 28, 26, 26, 24, 28, 24, 28, 22, 24, 24, 30, 28, 28, 26, 28, 30, 24, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30, 30),
+)
+NUM_ERROR_CORRECTION_BLOCKS = (
+    (-1, 1, 1, 1, 1, 1, 2, 2, 2, 2, 4, 4, 4, 4, 4, 6, 6, 6, 6, 7, 8, 8, 9, 9, 10, 12, 12, 12, 13, 14, 15, 16, 17, 18, 19, 19, 20, 21, 22, 24, 25),
+    (-1, 1, 1, 1, 2, 2, 4, 4, 4, 5, 5, 5, 8, 9, 9, 10, 10, 11, 13, 14, 16, 17, 17, 18, 20, 21, 23, 25, 26, 28, 29, 31, 33, 35, 37, 38, 40, 43, 45, 47, 49),
+    (-1, 1, 1, 2, 2, 4, 4, 6, 6, 8, 8, 8, 10, 12, 16, 12, 17, 16, 18, 21, 20, 23, 23, 25, 27, 29, 34, 34, 35, 38, 40, 43, 45, 48, 51, 53, 56, 59, 62, 65, 68),
+    (-1, 1, 1, 2, 4, 4, 4, 5, 6, 8, 8, 11, 11, 16, 16, 18, 16, 19, 21, 25, 25, 25, 34, 30, 32, 35, 37, 40, 42, 45, 48, 51, 54, 57, 60, 63, 66, 70, 74, 77, 81),
+)
+MASKS = (
+    lambda x, y: (x + y) % 2 == 0,
+    lambda x, y: y % 2 == 0,
+    lambda x, y: x % 3 == 0,
+    lambda x, y: (x + y) % 3 == 0,
+    lambda x, y: (x // 3 + y // 2) % 2 == 0,
+    lambda x, y: x * y % 2 + x * y % 3 == 0,
+    lambda x, y: (x * y % 2 + x * y % 3) % 2 == 0,
+    lambda x, y: ((x + y) % 2 + x * y % 3) % 2 == 0,
+)
+
+# GF(256) over x^8 + x^4 + x^3 + x^2 + 1
+EXP = [0] * 512
+LOG = [0] * 256
+_x = 1
+for _i in range(255):
+    EXP[_i] = _x
+    LOG[_x] = _i
+    _x <<= 1
+    if _x & 0x100:
+        _x ^= 0x11D
+for _i in range(255, 512):
+    EXP[_i] = EXP[_i - 255]
+
+def _mul(a, b): return EXP[LOG[a] + LOG[b]] if a and b else 0
+
+@lru_cache(maxsize=None)
+def _generator(degree):
+    poly = [0] * (degree - 1) + [1]
+    root = 1
+    for _ in range(degree):
+        for j in range(degree):
+            poly[j] = _mul(poly[j], root)
+            if j + 1 < degree:
+                poly[j] ^= poly[j + 1]
+        root = _mul(root, 2)
+    return poly
+
+def _ecc(data, degree):
+    divisor = _generator(degree)
+    rem = [0] * degree
+    for byte in data:
+        factor = byte ^ rem.pop(0)
+        rem.append(0)
+        if factor:
+            for i, coef in enumerate(divisor):
+                rem[i] ^= _mul(coef, factor)
+    return rem
+
+def _raw_modules(version):
+    result = (16 * version + 128) * version + 64
+    if version >= 2:
+        n = version // 7 + 2
+        result -= (25 * n - 10) * n - 55
+        if version >= 7:
+            result -= 36
+    return result
+
+def _data_codewords(version, level):
+    e = ECC_LEVELS.index(level)
+    return _raw_modules(version) // 8 - ECC_CODEWORDS_PER_BLOCK[e][version] * NUM_ERROR_CORRECTION_BLOCKS[e][version]
+
+def _alignment_positions(version):
+    if version == 1:
+        return []
+    n = version // 7 + 2
+    step = (version * 8 + n * 3 + 5) // (n * 4 - 4) * 2
+    size = version * 4 + 17
+    return [6] + sorted(size - 7 - i * step for i in range(n - 1))
+
+def _codewords(data, level):
+    for version in range(1, 41):
+        count_bits = 8 if version < 10 else 16
+        capacity = _data_codewords(version, level) * 8
+        if 4 + count_bits + len(data) * 8 <= capacity:
+            break
+    else:
+        raise ValueError(f"{len(data)} bytes do not fit in a version 40-{level} QR code")
+    bits = [0, 1, 0, 0] + [(len(data) >> i) & 1 for i in reversed(range(count_bits))]
+    for byte in data:
+        bits.extend((byte >> i) & 1 for i in reversed(range(8)))
+    bits.extend([0] * min(4, capacity - len(bits)))
+    bits.extend([0] * (-len(bits) % 8))
+    codewords = [int("".join(map(str, bits[i:i + 8])), 2) for i in range(0, len(bits), 8)]
+    pad = 0xEC
+    while len(codewords) < capacity // 8:
+        codewords.append(pad)
+        pad ^= 0xEC ^ 0x11
+    # split into blocks, append each block's error correction, then interleave
+    e = ECC_LEVELS.index(level)
+    num_blocks = NUM_ERROR_CORRECTION_BLOCKS[e][version]
+    ecc_len = ECC_CODEWORDS_PER_BLOCK[e][version]
+    raw = _raw_modules(version) // 8
+    num_short = num_blocks - raw % num_blocks
+    short_len = raw // num_blocks
+    blocks, k = [], 0
+    for i in range(num_blocks):
+        n = short_len - ecc_len + (0 if i < num_short else 1)
+        block = codewords[k:k + n]
+        k += n
+        ecc = _ecc(block, ecc_len)
+        if i < num_short:
+            block.append(None)
+        blocks.append(block + ecc)
+    result = [block[i] for i in range(len(blocks[0])) for block in blocks if block[i] is not None]
+    return version, result
+
+class _Matrix:
+    def __init__(self, version):
+        self.version = version
+        self.size = version * 4 + 17
+        self.modules = [[False] * self.size for _ in range(self.size)]
+        self.function = [[False] * self.size for _ in range(self.size)]
+    def copy(self):
+        # format bits only touch modules that are already marked as function modules
+        other = _Matrix.__new__(_Matrix)
+        other.version, other.size, other.function = self.version, self.size, self.function
+        other.modules = [row[:] for row in self.modules]
+        return other
+    def set_function(self, x, y, dark):
+        self.modules[y][x] = dark
+        self.function[y][x] = True
+    def draw_function_patterns(self):
+        size = self.size
+        for i in range(size):
+            self.set_function(6, i, i % 2 == 0)
+            self.set_function(i, 6, i % 2 == 0)
+        for cx, cy in ((3, 3), (size - 4, 3), (3, size - 4)):
+            for dy in range(-4, 5):
+                for dx in range(-4, 5):
+                    x, y = cx + dx, cy + dy
+                    if 0 <= x < size and 0 <= y < size:
+                        self.set_function(x, y, max(abs(dx), abs(dy)) not in (2, 4))
+        positions = _alignment_positions(self.version)
+        last = len(positions) - 1
+        for i, cx in enumerate(positions):
+            for j, cy in enumerate(positions):
+                if (i, j) in ((0, 0), (0, last), (last, 0)):
+                    continue
+                for dy in range(-2, 3):
+                    for dx in range(-2, 3):
+                        self.set_function(cx + dx, cy + dy, max(abs(dx), abs(dy)) != 1)
+        self.draw_format_bits(FORMAT_BITS['M'], 0)
+        if self.version >= 7:
+            rem = self.version
+            for _ in range(12):
+                rem = (rem << 1) ^ ((rem >> 11) * 0x1F25)
+            bits = self.version << 12 | rem
+            for i in range(18):
+                dark = (bits >> i) & 1 == 1
+                a, b = size - 11 + i % 3, i // 3
+                self.set_function(a, b, dark)
+                self.set_function(b, a, dark)
+    def draw_format_bits(self, level_bits, mask):
+        data = level_bits << 3 | mask
+        rem = data
+        for _ in range(10):
+            rem = (rem << 1) ^ ((rem >> 9) * 0x537)
+        bits = (data << 10 | rem) ^ 0x5412
+        bit = lambda i: (bits >> i) & 1 == 1
+        size = self.size
+        for i in range(6):
+            self.set_function(8, i, bit(i))
+        self.set_function(8, 7, bit(6))
+        self.set_function(8, 8, bit(7))
+        self.set_function(7, 8, bit(8))
+        for i in range(9, 15):
+            self.set_function(14 - i, 8, bit(i))
+        for i in range(8):
+            self.set_function(size - 1 - i, 8, bit(i))
+        for i in range(8, 15):
+            self.set_function(8, size - 15 + i, bit(i))
+        self.set_function(8, size - 8, True)
+    def draw_codewords(self, codewords):
+        size = self.size
+        i, total = 0, len(codewords) * 8
+        right = size - 1
+        while right >= 1:
+            if right == 6:
+                right = 5
+            upward = (right + 1) & 2 == 0
+            for vert in range(size):
+                y = size - 1 - vert if upward else vert
+                for x in (right, right - 1):
+                    if not self.function[y][x] and i < total:
+                        self.modules[y][x] = (codewords[i >> 3] >> (7 - (i & 7))) & 1 == 1
+                        i += 1
+            right -= 2
+    def apply_mask(self, mask):
+        test = MASKS[mask]
+        for y in range(self.size):
+            row, function = self.modules[y], self.function[y]
+            for x in range(self.size):
+                if not function[x] and test(x, y):
+                    row[x] = not row[x]
+    def penalty(self):
+        size, modules = self.size, self.modules
+        score = 0
+        lines = ["".join("1" if m else "0" for m in row) for row in modules]
+        lines += ["".join(lines[y][x] for y in range(size)) for x in range(size)]
+        for line in lines:
+            run, prev = 0, None
+            for c in line:
+                if c == prev:
+                    run += 1
+                else:
+                    if run >= 5:
+                        score += run - 2
+                    run, prev = 1, c
+            if run >= 5:
+                score += run - 2
+            # finder-like 1:1:3:1:1 runs with four light modules on either side, border counts as light
+            padded = "0000" + line + "0000"
+            for pattern in ("00001011101", "10111010000"):
+                start = padded.find(pattern)
+                while start != -1:
+                    score += 40
+                    start = padded.find(pattern, start + 1)
+        for y in range(size - 1):
+            top, bottom = modules[y], modules[y + 1]
+            for x in range(size - 1):
+                if top[x] == top[x + 1] == bottom[x] == bottom[x + 1]:
+                    score += 3
+        dark = sum(map(sum, modules))
+        total = size * size
+        # total is odd, so k >= 0
+        k = (abs(dark * 20 - total * 10) + total - 1) // total - 1
+        return score + k * 10
+
+def encode(data, level='M'):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    if level not in ECC_LEVELS:
+        raise ValueError(f"Unknown error correction level {level!r}")
+    version, codewords = _codewords(data, level)
+    base = _Matrix(version)
+    base.draw_function_patterns()
+    base.draw_codewords(codewords)
+    best = None
+    for mask in range(8):
+        matrix = base.copy()
+        matrix.apply_mask(mask)
+        matrix.draw_format_bits(FORMAT_BITS[level], mask)
+        score = matrix.penalty()
+        if best is None or score < best[0]:
+            best = (score, matrix)
+    return best[1].modules
+
+def _chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+def to_png(modules, scale=8, border=4):
+    # 8-bit grayscale, dark modules black; rows repeat `scale` times so zlib squeezes them flat
+    width = (len(modules) + border * 2) * scale
+    quiet = b"\x00" + b"\xff" * width
+    raw = [quiet] * (border * scale)
+    for row in modules:
+        line = b"\xff" * (border * scale) + b"".join(b"\x00" * scale if m else b"\xff" * scale for m in row) + b"\xff" * (border * scale)
+        raw.extend([b"\x00" + line] * scale)
+    raw.extend([quiet] * (border * scale))
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + _chunk(b"IHDR", struct.pack(">IIBBBBB", width, width, 8, 0, 0, 0, 0))
+        + _chunk(b"IDAT", zlib.compress(b"".join(raw), 9))
+        + _chunk(b"IEND", b"")
+    )